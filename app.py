@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """ZUZZ TV v2.0 - Complete IPTV Platform with PWA, Subscriptions, Analytics, Security"""
-import os,json,hashlib,secrets,re,socket,sys,threading,time,smtplib
+import os,json,hashlib,secrets,re,socket,sys,threading,time,smtplib,copy,atexit,heapq,collections,math,zlib,base64,bisect,codecs,tempfile,gzip
+from array import array
 from datetime import datetime,timedelta
 from urllib.request import urlopen,Request
+from urllib.error import HTTPError
+from urllib.parse import urlparse,urljoin
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -23,9 +27,11 @@ from django.conf import settings
 
 BASE=os.path.dirname(os.path.abspath(__file__))
 DATA_FILE=os.path.join(BASE,'data.json')
-M3U_FILE=os.path.join(BASE,'m3u_lists.json')
+M3U_FILE=os.path.join(BASE,'m3u_lists.json')  # legacy single-file store, migrated into M3U_DIR
+M3U_DIR=os.path.join(BASE,'m3u')
 ANALYTICS_FILE=os.path.join(BASE,'analytics.json')
 RESET_TOKENS_FILE=os.path.join(BASE,'reset_tokens.json')
+LIMITS_FILE=os.path.join(BASE,'limits.json')  # rate-limit and lockout counters, when several worker processes share them
 
 SEC={'session_hours':24,'max_attempts':5,'lockout_mins':15,'rate_limit':100,'rate_window':60}
 rate_limits,login_attempts={},{}
@@ -144,118 +150,1149 @@ def generate_password(length=10):
     chars=string.ascii_letters+string.digits+'!@#$%'
     return ''.join(secrets.choice(chars)for _ in range(length))
 
-def load_data():
-    try:
-        with open(DATA_FILE,'r',encoding='utf-8')as f:d=json.load(f)
-        for k in DEFAULT_DATA:
-            if k not in d:d[k]=DEFAULT_DATA[k]
-        return d
-    except:import copy;return copy.deepcopy(DEFAULT_DATA)
+# ============ WORKER PROCESSES ============
+try:import fcntl  # POSIX; without it the app runs as one process
+except ImportError:fcntl=None
+LEADER_FILE=os.path.join(BASE,'.leader.lock')
+
+class ProcessLock:
+    """Exclusive lock shared by every worker process serving the app (flock on path); re-entrant
+    within a process, whose threads serialize on the inner RLock"""
+    def __init__(self,path):self.path=path;self.lock=threading.RLock();self.depth=0;self.fd=None;self.pid=None
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            if self.depth==0 and fcntl:
+                if self.pid!=os.getpid():  # a forked worker needs an open file of its own
+                    self.fd=os.open(self.path,os.O_RDWR|os.O_CREAT,0o644);self.pid=os.getpid()
+                fcntl.flock(self.fd,fcntl.LOCK_EX)
+        except:self.lock.release();raise
+        self.depth+=1;return self
+    def __exit__(self,*exc):
+        self.depth-=1
+        if self.depth==0 and fcntl:fcntl.flock(self.fd,fcntl.LOCK_UN)
+        self.lock.release()
+
+class Leader:
+    """With several worker processes, exactly one of them - whoever holds the flock on LEADER_FILE -
+    runs the scheduler, the stream prober, M3U jobs and analytics aggregation. The lock goes with
+    its process, so a waiting worker takes over at once when the leader exits. A process that
+    never calls start() (a script importing app.py) is on its own and does all of that itself.
+    shared says whether other worker processes may be serving too: serve() and the dev server know,
+    under any other WSGI server it is assumed."""
+    def __init__(self,path):self.path=path;self.enabled=False;self.leading=False;self.shared=True;self.lock=threading.Lock()
+    def start(self):
+        with self.lock:
+            if self.enabled:return
+            self.enabled=True
+        if fcntl is None:self._lead()
+        else:threading.Thread(target=self._wait,daemon=True,name='leader').start()
+    def _wait(self):
+        fd=os.open(self.path,os.O_RDWR|os.O_CREAT,0o644)
+        fcntl.flock(fd,fcntl.LOCK_EX)  # blocks while another worker leads
+        self.fd=fd;self._lead()
+    def _lead(self):
+        self.leading=True
+        log(f"[LEADER] Worker {os.getpid()} runs the scheduler, prober, jobs and analytics")
+        analytics.lead();jobs.lead();scheduler.start();prober.start()
+    def multi(self):
+        """Whether requests may be served by other worker processes as well as this one"""
+        return self.enabled and self.shared
+    def runs_background(self):
+        """Whether background work (jobs, analytics folding) belongs to this process"""
+        return self.leading or not self.enabled
+
+leader=Leader(LEADER_FILE)
+
+# ============ RESIDENT DATA STORE ============
+FLUSH_DELAY=2.0  # max seconds a mutation waits in memory before it is written to disk
+STORAGE=os.environ.get('ZUZZ_STORAGE','json')  # 'json' (data.json + journal) or 'sqlite' (zuzz.db)
+DB_FILE=os.path.join(BASE,'zuzz.db')
+JOURNAL_FILE=os.path.join(BASE,'data.journal')
+JOURNAL_MAX=4*1024*1024  # compact the journal into data.json once it grows past this
+COMPACT_INTERVAL=600     # ...or when it has been pending this many seconds
+SQLITE_CHANGES_KEEP=10000  # rows of zuzz.db's changes log kept for other workers to catch up from
+
+# collection -> (key column, indexed columns); other top-level keys are stored whole under 'kv'
+COLLECTIONS={
+    'users':('id',['username']),'viewers':('id',['username','email']),
+    'plans':('id',[]),'subscriptions':('id',['viewer_id']),
+    'sessions':('token',['user_id']),'viewer_sessions':('token',['viewer_id'])
+}
 
-def save_data(d):
-    try:
-        with open(DATA_FILE,'w',encoding='utf-8')as f:
-            json.dump(d,f,ensure_ascii=False,indent=2)
-        log(f"[DB] Data saved successfully")
-    except Exception as e:
-        log(f"[DB] ERROR saving data: {e}")
-        raise e
+class RowBackend:
+    """Remembers the last written JSON of every record so a flush only writes changed ones.
+    touched maps collection -> set of keys (or None for the whole collection); touched=None diffs everything."""
+    def remember(self,d):
+        self.rows={'kv':{}}
+        for t,key,rec,body in self.changes(d):self.rows.setdefault(t,{})[key]=body
+    def _records(self,d,t):
+        v=d.get(t)or({}if COLLECTIONS[t][0]=='token'else[])
+        return v if COLLECTIONS[t][0]=='token'else{x.get('id'):x for x in v}
+    def changes(self,d,touched=None):
+        """Return (table,key,record,body) for new/changed rows and (table,key,None,None) for removed ones"""
+        out=[]
+        for t in list(COLLECTIONS)+[k for k in d if k not in COLLECTIONS]:
+            if touched is not None and t not in touched:continue
+            old=self.rows.setdefault('kv'if t not in COLLECTIONS else t,{})
+            if t not in COLLECTIONS:
+                body=json.dumps(d[t],ensure_ascii=False)
+                if old.get(t)!=body:out.append(('kv',t,d[t],body))
+                continue
+            recs=self._records(d,t);keys=touched.get(t)if touched else None
+            for key in(recs if keys is None else keys):
+                rec=recs.get(key)
+                if rec is None:continue
+                body=json.dumps(rec,ensure_ascii=False)
+                if old.get(key)!=body:out.append((t,key,rec,body))
+            for key in[x for x in(old if keys is None else keys)if x in old and x not in recs]:out.append((t,key,None,None))
+        if touched is None:
+            out+=[('kv',k,None,None)for k in self.rows['kv']if k not in d]
+        return out
+    def applied(self,changes):
+        for t,key,rec,body in changes:
+            if body is None:self.rows[t].pop(key,None)
+            else:self.rows[t][key]=body
+
+class JournalBackend(RowBackend):
+    """data.json snapshot plus an append-only data.journal of record-level changes.
+    Each flush appends and fsyncs one batch; compact() folds the journal into a fresh snapshot.
+    offset is how far into the journal this process has read or written, so entries other
+    worker processes append can be caught up with without reloading."""
+    name='json'
+    def __init__(self,path,journal):
+        self.path=path;self.jpath=journal;self.rows={};self.compacted=time.time();self.offset=0;self.base=None
+    def _stat(self,p):
+        try:st=os.stat(p);return st.st_mtime_ns,st.st_size
+        except OSError:return None
+    def stamp(self):return self._stat(self.path),self._stat(self.jpath)
+    def load(self):
+        try:
+            with open(self.path,'r',encoding='utf-8')as f:d=json.load(f)
+        except:d={}
+        self.base=self._stat(self.path);self.offset=0
+        n=self._replay(d)
+        if n:log(f"[DB] Replayed {n} journal entries")
+        self.remember(d)
+        return d
+    def _replay(self,d,seen=None):
+        """Apply journal entries from offset on; seen, if given, collects their (table, key)"""
+        if not os.path.exists(self.jpath):return 0
+        n=0;good=self.offset;idx={}
+        with open(self.jpath,'rb')as f:
+            f.seek(self.offset)
+            for line in f:
+                try:op=json.loads(line)
+                except ValueError:break  # torn write from a crash: drop it and everything after
+                good+=len(line);n+=1
+                t,key=op['t'],op['k']
+                if seen is not None:seen.add((t,key))
+                if t=='kv':
+                    if 'v'in op:d[key]=op['v']
+                    else:d.pop(key,None)
+                elif COLLECTIONS[t][0]=='token':
+                    if 'v'in op:d.setdefault(t,{})[key]=op['v']
+                    else:d.get(t,{}).pop(key,None)
+                else:
+                    lst=d.setdefault(t,[])
+                    if t not in idx:idx[t]={x.get('id'):i for i,x in enumerate(lst)}
+                    i=idx[t].get(key)
+                    if 'v'in op:
+                        if i is None:idx[t][key]=len(lst);lst.append(op['v'])
+                        else:lst[i]=op['v']
+                    elif i is not None:lst[i]=None;del idx[t][key]
+        for t in idx:d[t]=[x for x in d[t]if x is not None]
+        if good<os.path.getsize(self.jpath):
+            with open(self.jpath,'r+b')as f:f.truncate(good)
+        self.offset=good
+        return n
+    def catch_up(self,d):
+        """Apply in place what other processes appended since we last read or wrote the journal;
+        returns the tables touched, or None when the snapshot was rewritten and d must be reloaded"""
+        if self._stat(self.path)!=self.base:return None
+        seen=set();self._replay(d,seen);tables=set();recs={}
+        for t,key in seen:
+            tables.add(key if t=='kv'else t);old=self.rows.setdefault(t,{})
+            if t=='kv':v=d.get(key)
+            else:
+                if t not in recs:recs[t]=self._records(d,t)
+                v=recs[t].get(key)
+            if v is None:old.pop(key,None)
+            else:old[key]=json.dumps(v,ensure_ascii=False)
+        return tables
+    def write(self,d,touched=None):
+        ch=self.changes(d,touched)
+        if not ch:return'no changes'
+        buf=''.join(json.dumps({'t':t,'k':key,'v':rec}if body is not None else{'t':t,'k':key},ensure_ascii=False)+'\n'for t,key,rec,body in ch)
+        with open(self.jpath,'a',encoding='utf-8')as f:
+            f.write(buf);f.flush();os.fsync(f.fileno());self.offset=f.tell()
+        self.applied(ch)
+        return f"{len(ch)} changes"
+    def should_compact(self):
+        st=self._stat(self.jpath)
+        return bool(st and st[1]and(st[1]>JOURNAL_MAX or time.time()-self.compacted>COMPACT_INTERVAL))
+    def compact(self,d):
+        body=json.dumps(d,ensure_ascii=False)
+        tmp=self.path+'.tmp'
+        with open(tmp,'w',encoding='utf-8')as f:f.write(body);f.flush();os.fsync(f.fileno())
+        os.replace(tmp,self.path)
+        # Journal entries are absolute record values, so a crash before this truncate just replays harmlessly
+        open(self.jpath,'w').close()
+        self.compacted=time.time();self.offset=0;self.base=self._stat(self.path)
+        log(f"[DB] Compacted journal into data.json ({len(body)//1024}KB)")
+
+class SqliteBackend(RowBackend):
+    """Row-per-record storage in zuzz.db (WAL mode).
+    Records keep their JSON shape in a body column; only changed rows are written. Each write also
+    logs its (table, key)s in the changes table, and seq is how far into that log this process has
+    read or written, so other worker processes' rows can be caught up with without reloading."""
+    name='sqlite'
+    def __init__(self,path):
+        self.path=path;self.rows={};self.conn=None;self.pid=None;self.imported=False;self.seq=0
+        for t,(k,cols) in COLLECTIONS.items():
+            kt='INTEGER PRIMARY KEY'if k=='id'else'TEXT PRIMARY KEY'
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {t}({k} {kt},{''.join(c+',' for c in cols)}body TEXT NOT NULL)")
+        self.db.execute('CREATE TABLE IF NOT EXISTS kv(key TEXT PRIMARY KEY,body TEXT NOT NULL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS changes(seq INTEGER PRIMARY KEY AUTOINCREMENT,t TEXT NOT NULL,k TEXT NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS users_username ON users(lower(username))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS viewers_username ON viewers(lower(username))')
+        self.db.execute('DROP INDEX IF EXISTS viewers_email')
+        self.db.execute('CREATE INDEX IF NOT EXISTS viewers_email_lower ON viewers(lower(email))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS viewer_sessions_viewer ON viewer_sessions(viewer_id)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS subscriptions_viewer ON subscriptions(viewer_id)')
+        if not self.db.execute('SELECT 1 FROM kv LIMIT 1').fetchone()and os.path.exists(DATA_FILE):
+            self.import_json(DATA_FILE);self.imported=True  # a fresh database starts from data.json
+    @property
+    def db(self):
+        """This process's connection: one opened before a fork must not be used by the child"""
+        if self.pid!=os.getpid():
+            import sqlite3
+            self.conn=sqlite3.connect(self.path,check_same_thread=False,isolation_level=None);self.pid=os.getpid()
+            self.conn.execute('PRAGMA journal_mode=WAL');self.conn.execute('PRAGMA synchronous=NORMAL')
+        return self.conn
+    def stamp(self):return self.db.execute('PRAGMA data_version').fetchone()[0]
+    def catch_up(self,d):
+        """Apply in place the rows other connections wrote since we last read or wrote; returns the
+        tables touched, or None when the changes log no longer reaches back (or was bypassed) and d
+        must be reloaded"""
+        rows=self.db.execute('SELECT seq,t,k FROM changes WHERE seq>? ORDER BY seq',(self.seq,)).fetchall()
+        if not rows or rows[0][0]!=self.seq+1 and self.db.execute('SELECT min(seq) FROM changes').fetchone()[0]>self.seq+1:return None
+        tables=set();idx={}
+        for t,k in dict.fromkeys((t,k)for _,t,k in rows):
+            if t=='kv':
+                r=self.db.execute('SELECT body FROM kv WHERE key=?',(k,)).fetchone();old=self.rows.setdefault('kv',{})
+                if r:d[k]=json.loads(r[0]);old[k]=r[0]
+                else:d.pop(k,None);old.pop(k,None)
+                tables.add(k);continue
+            kc=COLLECTIONS[t][0];key=k if kc=='token'else int(k);old=self.rows.setdefault(t,{})
+            r=self.db.execute(f'SELECT body FROM {t} WHERE {kc}=?',(key,)).fetchone();v=json.loads(r[0])if r else None
+            if r:old[key]=r[0]
+            else:old.pop(key,None)
+            if kc=='token':
+                if v is None:d.get(t,{}).pop(key,None)
+                else:d.setdefault(t,{})[key]=v
+            else:
+                lst=d.setdefault(t,[])
+                if t not in idx:idx[t]={x.get('id'):i for i,x in enumerate(lst)}
+                i=idx[t].get(key)
+                if v is None:
+                    if i is not None:lst[i]=None;del idx[t][key]
+                elif i is None:idx[t][key]=len(lst);lst.append(v)
+                else:lst[i]=v
+            tables.add(t)
+        for t in idx:
+            if None in d[t]:d[t]=[x for x in d[t]if x is not None]
+        self.seq=rows[-1][0]
+        return tables
+    def load(self):
+        d={};self.rows={};self.seq=self.db.execute('SELECT coalesce(max(seq),0) FROM changes').fetchone()[0]
+        for t,(k,_) in COLLECTIONS.items():
+            rows=self.db.execute(f'SELECT {k},body FROM {t} ORDER BY rowid').fetchall()
+            self.rows[t]=dict(rows)
+            d[t]={r[0]:json.loads(r[1])for r in rows}if k=='token'else[json.loads(r[1])for r in rows]
+        rows=self.db.execute('SELECT key,body FROM kv').fetchall()
+        self.rows['kv']=dict(rows)
+        for key,body in rows:d[key]=json.loads(body)
+        return d
+    def write(self,d,touched=None):
+        ch=self.changes(d,touched)
+        self.db.execute('BEGIN')
+        try:
+            for t,key,rec,body in ch:
+                k,cols=COLLECTIONS.get(t,('key',[]))
+                if body is None:self.db.execute(f'DELETE FROM {t} WHERE {k}=?',(key,))
+                else:
+                    names=[k]+cols+['body']
+                    self.db.execute(f"INSERT OR REPLACE INTO {t}({','.join(names)}) VALUES({','.join('?'*len(names))})",
+                        [key]+[rec.get(c)for c in cols]+[body])
+            seq=self.seq
+            if ch:
+                self.db.executemany('INSERT INTO changes(t,k) VALUES(?,?)',[(t,str(key))for t,key,_,_ in ch])
+                seq=self.db.execute('SELECT max(seq) FROM changes').fetchone()[0]
+                self.db.execute('DELETE FROM changes WHERE seq<=?',(seq-SQLITE_CHANGES_KEEP,))
+            self.db.execute('COMMIT')
+        except:self.db.execute('ROLLBACK');raise
+        self.seq=seq;self.applied(ch)
+        return f"{len(ch)} rows"
+    def find_viewer_ids(self,username=None,email=None):
+        return[r[0]for r in self.db.execute('SELECT id FROM viewers WHERE lower(username)=? OR lower(email)=?',
+            (username.lower()if username else None,email.lower()if email else None))]
+    def import_json(self,path):
+        """One-shot import of an existing data.json (and its journal, if any)"""
+        d=JournalBackend(path,JOURNAL_FILE).load()
+        self.rows={};self.write(d)
+        log(f"[DB] Imported {path}: {len(d.get('viewers',[]))} viewers, {len(d.get('users',[]))} users")
+
+class DataStore:
+    """Process-resident copy of the database.
+    Reads are served from memory; save_data() only marks the store dirty and a
+    write-behind flusher persists all pending mutations at most FLUSH_DELAY later.
+    Several worker processes may share the files: writes hold a ProcessLock, and each
+    process takes in the others' writes (journal catch-up, else a reload) before reading on."""
+    def __init__(self,backend):
+        self.backend=backend;self.data=None;self.stamp=None;self.dirty=False;self.touched={};self.version=0;self.loads=0
+        self.base=0;self.changed={}  # version of the last full reload / unhinted write; collection -> version it last changed at
+        self.foreign={}  # collection -> version at which another process's change to it was caught up with
+        self.vidx,self.vidx_src,self.vidx_len,self.vidx_version={},None,0,-1  # viewer id -> record, for the list indexed up to vidx_len
+        self.ids={}  # collection -> (version, highest id seen or handed out)
+        self.lock=threading.RLock();self.cond=threading.Condition(self.lock);self.flusher=None
+        self.plock=ProcessLock(backend.path+'.lock')
+    def get(self):
+        with self.lock:
+            # Pick up edits made behind our back: other workers, debug_users.py
+            if self.data is None or self.backend.stamp()!=self.stamp:
+                with self.plock:self._sync()
+            return self.data
+    def _sync(self):
+        """Load, or catch up with what was written elsewhere since we last looked; caller holds both locks"""
+        st=self.backend.stamp()
+        if self.data is not None:
+            if st==self.stamp:return
+            tables=self.backend.catch_up(self.data)
+            if tables is not None:
+                self.stamp=self.backend.stamp();self.version+=1
+                for t in tables:self.changed[t]=self.foreign[t]=self.version
+                return
+            if self.dirty:self._write()  # ours reach disk before the reload replaces memory
+        d=self.backend.load()
+        for k in DEFAULT_DATA:
+            if k not in d:d[k]=copy.deepcopy(DEFAULT_DATA[k])
+        self.data=d;self.stamp=self.backend.stamp();self.version+=1;self.loads+=1;self.base=self.version
+    def put(self,d,hints=()):
+        """hints name what changed: a collection or top-level key, or a (collection,key) pair.
+        Without hints the next flush diffs the whole document."""
+        with self.lock:
+            self.data=d;self.dirty=True;self.version+=1
+            if not hints:self.base=self.version
+            for h in hints:self.changed[h[0]if isinstance(h,tuple)else h]=self.version
+            if not hints:self.touched=None
+            elif self.touched is not None:
+                for h in hints:
+                    if isinstance(h,tuple):
+                        keys=self.touched.setdefault(h[0],set())
+                        if keys is not None:keys.add(h[1])
+                    else:self.touched[h]=None
+            if not self.flusher:
+                self.flusher=threading.Thread(target=self._run,daemon=True,name='data-flusher');self.flusher.start()
+                if hasattr(self.backend,'compact'):threading.Thread(target=self._compactor,daemon=True,name='data-compactor').start()
+            if leader.multi():
+                # Another worker process may serve this client's next request (with the token just issued)
+                try:self.flush();return
+                except Exception as e:log(f"[DB] ERROR saving data: {e}")  # the flusher retries
+            self.cond.notify()
+    def version_of(self,*names):
+        """Store version at which any of these collections last changed"""
+        with self.lock:return max([self.base]+[self.changed.get(n,0)for n in names])
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.dirty:self.cond.wait()
+            time.sleep(FLUSH_DELAY)  # let further mutations coalesce into one write
+            try:self.flush()
+            except Exception as e:log(f"[DB] ERROR saving data: {e}");time.sleep(FLUSH_DELAY)
+    def _compactor(self):
+        while True:
+            time.sleep(30)
+            try:
+                with self.lock:
+                    if self.backend.should_compact():self.compact()
+            except Exception as e:log(f"[DB] ERROR compacting: {e}")
+    def _write(self):
+        touched,self.touched,self.dirty=self.touched,{},False
+        try:return self.backend.write(self.data,touched)
+        except:self.dirty=True;self.touched=None;raise
+    def flush(self):
+        with self.lock:
+            if not self.dirty:return
+            with self.plock:
+                self._sync()  # another worker's entries go under ours, not over them
+                if not self.dirty:return
+                info=self._write();self.stamp=self.backend.stamp()
+        log(f"[DB] Data saved ({info})")
+    def compact(self):
+        with self.lock:
+            self.flush()
+            if self.data is not None and hasattr(self.backend,'compact'):
+                with self.plock:
+                    self._sync()  # fold in what other workers appended before the journal is cleared
+                    self.backend.compact(self.data);self.stamp=self.backend.stamp()
+    def next_id(self,name):
+        """A fresh id for a record of collection name: one past the highest seen or handed out.
+        The collection is only rescanned after a reload or another process's write to it."""
+        with self.lock:
+            lst=self.get().get(name,[]);v=self.ids.get(name)
+            if v is None or v[0]<max(self.base,self.foreign.get(name,0))or(lst and(lst[-1].get('id')or 0)>v[1]):
+                v=(self.version,max([x.get('id')or 0 for x in lst],default=0))
+            self.ids[name]=(self.version,v[1]+1);return v[1]+1
+    def viewer(self,vid):
+        """Viewer by id. Records are edited in place and new ones appended, so the index only picks
+        up the tail; it is rebuilt when the list is replaced or shrinks, or on a reload or another
+        process's write to it."""
+        with self.lock:
+            vs=self.get().get('viewers',[]);ver=max(self.base,self.foreign.get('viewers',0))
+            if vs is not self.vidx_src or len(vs)<self.vidx_len or ver!=self.vidx_version:
+                self.vidx={v['id']:v for v in vs};self.vidx_src=vs;self.vidx_version=ver
+            else:
+                for i in range(self.vidx_len,len(vs)):self.vidx[vs[i]['id']]=vs[i]
+            self.vidx_len=len(vs);return self.vidx.get(vid)
+    def find_viewers(self,username=None,email=None):
+        """Viewers whose username or email matches (both case-insensitive)"""
+        with self.lock:
+            d=self.get();u=username.lower()if username else None;e=email.lower()if email else None
+            match=lambda v:v and((u and v['username'].lower()==u)or(e and v.get('email','').lower()==e))
+            t=self.touched if self.dirty else{}
+            if hasattr(self.backend,'find_viewer_ids')and t is not None and t.get('viewers',())is not None:
+                # The index lags behind unflushed writes: re-check its hits and the viewers changed since in memory
+                ids=set(self.backend.find_viewer_ids(u,e))|set(t.get('viewers',()))
+                return[v for v in map(self.viewer,sorted(ids))if match(v)]
+            return[v for v in d.get('viewers',[])if match(v)]
+
+store=DataStore(SqliteBackend(DB_FILE)if STORAGE=='sqlite'else JournalBackend(DATA_FILE,JOURNAL_FILE))
+atexit.register(store.compact)
+
+def load_data():return store.get()
+
+def save_data(d,*hints):store.put(d,hints)
+
+def get_viewer(vid):return store.viewer(vid)
+
+def find_viewers(username=None,email=None):return store.find_viewers(username,email)
+
+def transactional(view):
+    """Run a view that hands out ids or checks-then-writes under both store locks: no other thread
+    or worker process writes between its load_data() and its save_data(), which with several
+    workers writes through before the locks are released"""
+    @wraps(view)
+    def run(*a,**k):
+        with store.lock,store.plock:return view(*a,**k)
+    return run
+
+def write_json_atomic(path,d):
+    tmp=path+'.tmp'
+    # json.dumps runs the C encoder; json.dump to a file streams through the pure-Python one
+    with open(tmp,'w',encoding='utf-8')as f:f.write(json.dumps(d,ensure_ascii=False))
+    os.replace(tmp,path)
 
 def load_m3u():
     try:
         with open(M3U_FILE,'r',encoding='utf-8')as f:return json.load(f)
     except:return{"lists":[]}
 
-def save_m3u(d):
-    with open(M3U_FILE,'w',encoding='utf-8')as f:json.dump(d,f,ensure_ascii=False,indent=2)
+# ============ M3U LIST STORE ============
+M3U_CACHE_LISTS=4  # channel shards kept in memory
+M3U_PAGE,M3U_PAGE_MAX=100,1000  # default / largest page of /api/m3u/channels
+M3U_REFRESH_WORKERS=6  # lists refreshed concurrently by the scheduler
+M3U_PER_HOST=2         # simultaneous downloads from one provider host
+M3U_BANDWIDTH=0        # total download budget for playlists in bytes/s, 0 = unlimited
+M3U_CHANGES_KEEP=20    # change sets kept per list for /api/m3u/channels/<id>?since= (cids only, records come from the list)
+CANON_BUCKET=20000     # canonical channel ids per m3u/canon_<n>.json file
+CANON_KEY_FILES=64     # m3u/canon_keys_<n>.json files the catalog's match index is hashed over
+
+def channel_keys(chs):
+    """Stable identity of each channel: tvg-id, else URL; identities shared within the list fall
+    back to the URL, then URL+name, and finally get an occurrence suffix"""
+    keys=[('id:'+c['attrs']['tvg-id'])if c.get('attrs',{}).get('tvg-id')else'url:'+c['url']for c in chs]
+    n=collections.Counter(keys)
+    keys=[k if n[k]==1 else'url:'+c['url']for k,c in zip(keys,chs)]
+    n=collections.Counter(keys);seen=collections.Counter();out=[]
+    for k,c in zip(keys,chs):
+        if n[k]>1:
+            k=f"{k}|{c.get('name','')}";seen[k]+=1
+            if seen[k]>1:k=f'{k}#{seen[k]}'
+        out.append(k)
+    return out
+
+def m3u_channel(sh,cid):
+    """Channel cid of a loaded shard; the cid -> position map lives on the cached shard only"""
+    chs=sh.get('channels',[]);pos=sh.get('cid_pos',{}).get(cid)
+    if pos is None or pos>=len(chs)or chs[pos].get('cid',pos)!=cid:
+        sh['cid_pos']={c.get('cid',i):i for i,c in enumerate(chs)};pos=sh['cid_pos'].get(cid)
+    return chs[pos]if pos is not None else None
+
+def changes_since(sh,since):
+    """Fold the change sets after version since into one delta (added/updated records, removed cids),
+    or None when since predates the retained feed and the client must reload. The feed holds cids
+    only; added/updated channels are returned as they stand in the list now."""
+    chg=sh.get('changes',[]);ver=sh.get('version',0)
+    if since>=ver:return{'added':[],'updated':[],'removed':[]}
+    if not chg or since<chg[0]['version']-1:return None
+    state={};cid=lambda x:x['cid']if isinstance(x,dict)else x  # feeds written before held whole records
+    for c in chg:
+        if c['version']<=since:continue
+        for x in c['added']:state[cid(x)]='added'
+        for x in c['updated']:state[cid(x)]='added'if state.get(cid(x))=='added'else'updated'
+        for x in c['removed']:
+            if state.get(x)=='added':del state[x]
+            else:state[x]='removed'
+    out={'added':[],'updated':[],'removed':[]}
+    for x,kind in state.items():
+        if kind=='removed':out[kind].append(x)
+        else:
+            ch=m3u_channel(sh,x)
+            if ch is not None:out[kind].append(ch)
+    return out
+
+def group_index(chs):
+    """group-title -> ascending channel positions"""
+    idx={}
+    for i,c in enumerate(chs):idx.setdefault(c.get('group','Other'),[]).append(i)
+    return idx
+
+CANON_NOISE=re.compile(r'\b(?:hd|fhd|uhd|sd|4k|8k|hevc|h26[45]|1080[pi]?|720p|[56]0 ?fps|backup)\b|[\W_]+')
+
+CANON_URL=re.compile(r'\s*(?:[a-zA-Z][\w+.-]*:)?//(?:[^@/?#]*@)?([^/?#:]*)(?::(\d*))?([^?#]*)(?:\?([^#]*))?')
+CANON_XTREAM=re.compile(r'/live/[^/]+/[^/]+/(\d+)(?:\.\w+)?')
+CANON_XTREAM_BARE=re.compile(r'/[^/]+/[^/]+/(\d+)(?:\.\w+)?')
+
+def norm_url(u,xtream=False):
+    """Stream URL with the parts that don't change the stream folded away: scheme, host case, default
+    port, and Xtream credentials/extension (/live/<user>/<pass>/<id>.m3u8 -> /live/<id>). The bare
+    /<user>/<pass>/<id> form is only folded for channels known to come from an Xtream panel:
+    elsewhere three path segments ending in a number say nothing about the stream."""
+    m=CANON_URL.match(u)
+    if not m:return u.strip()
+    host,port,path,q=m.groups();host=host.lower()
+    if port and port not in('80','443'):host+=':'+port
+    x=CANON_XTREAM.fullmatch(path)or(xtream and CANON_XTREAM_BARE.fullmatch(path))
+    if x:path='/live/'+x.group(1)
+    return host+path.rstrip()+('?'+'&'.join(sorted(q.strip().split('&')))if q else'')
+
+def norm_name(n):
+    """'UK: BBC One FHD' -> 'uk bbc one'; the country prefix stays, 'US: BBC One' is another channel"""
+    return' '.join(CANON_NOISE.sub(' ',(n or'').lower()).split())
+
+class ChannelCatalog:
+    """Canonical channel records shared by every M3U list (m3u/canon_<n>.json, CANON_BUCKET ids per
+    file so a refresh only rewrites the buckets it touched). A record is created by the first list
+    that carries a channel and never changes afterwards, so lists can store a reference plus only
+    the fields where their copy differs. Matching tries the normalized URL, then tvg-id, then the
+    normalized name, through an index hashed over CANON_KEY_FILES files (m3u/canon_keys_<n>.json);
+    records are refcounted by the lists using them. Buckets and index files are read on demand,
+    so resolving one list only loads the buckets its channels refer to."""
+    def __init__(self,path):
+        self.dir=path;self.lock=threading.RLock()
+        self.buckets={}  # bucket -> {id: record}, for the buckets loaded so far
+        self.keys={}     # index file -> {'u:'/'t:'/'n:' + normalized value: id}, for the files loaded so far
+        self.stamps={}   # path -> file_stamp as last read or written
+        self.dirty=set();self.dirty_keys=set();self.next=None
+        self.version=0  # bumped whenever records are saved or forgotten, i.e. match() answers may change
+    def _file(self,b):return os.path.join(self.dir,f'canon_{b}.json')
+    def _keyfile(self,n):return os.path.join(self.dir,f'canon_keys_{n}.json')
+    def _read(self,p):
+        self.stamps[p]=file_stamp(p)  # None for a missing file: refresh() notices when it appears
+        try:
+            with open(p,'r',encoding='utf-8')as f:return json.load(f)
+        except FileNotFoundError:return None
+    def _write(self,p,d):write_json_atomic(p,d);self.stamps[p]=file_stamp(p)
+    def _bucket(self,b):
+        bk=self.buckets.get(b)
+        if bk is None:bk=self.buckets[b]={int(k):rec for k,rec in(self._read(self._file(b))or{}).items()}
+        return bk
+    def _on_disk(self):
+        """Bucket numbers present on disk"""
+        return[int(m.group(1))for m in(re.fullmatch(r'canon_(\d+)\.json',fn)for fn in os.listdir(self.dir))if m]
+    def rec(self,cid):
+        return None if cid is None else self._bucket(cid//CANON_BUCKET).get(cid)
+    def _index(self,k):
+        """(file number, loaded index file) for key k"""
+        n=zlib.crc32(k.encode())%CANON_KEY_FILES;ks=self.keys.get(n)
+        if ks is None:
+            ks=self._read(self._keyfile(n))
+            if ks is None and not any(self.stamps.get(self._keyfile(i))or os.path.exists(self._keyfile(i))for i in range(CANON_KEY_FILES)):
+                if self._on_disk():self._build_index();return n,self.keys[n]  # catalog written before the index existed
+            ks=self.keys[n]=ks or{}
+        return n,ks
+    def _build_index(self):
+        """Index every record once. Only the process that writes M3U lists (see Leader) saves the
+        index files; the others keep theirs in memory until they appear."""
+        self.keys={n:{}for n in range(CANON_KEY_FILES)}
+        for b in sorted(self._on_disk()):
+            for cid,rec in sorted(self._bucket(b).items()):
+                for k in self._keys(rec):self.keys[zlib.crc32(k.encode())%CANON_KEY_FILES].setdefault(k,cid)
+        for n,ks in self.keys.items():
+            if leader.runs_background():self._write(self._keyfile(n),ks)
+            else:self.stamps[self._keyfile(n)]=None
+        if leader.runs_background():log(f"[M3U] Indexed the channel catalog")
+    def _keys(self,ch):
+        a=ch.get('attrs')or{}
+        ks=['u:'+norm_url(ch['url'],bool(a.get('stream_id')))]if ch.get('url')else[]
+        t=a.get('tvg-id')
+        if t:ks.append('t:'+t.strip().lower())
+        n=norm_name(ch.get('name'))
+        if n:ks.append('n:'+n)
+        return ks
+    def match(self,ch):
+        """Canonical id for a channel-like dict (name/url/attrs), or None"""
+        with self.lock:
+            return next((cid for cid in(self._index(k)[1].get(k)for k in self._keys(ch))if cid is not None),None)
+    def acquire(self,ch):
+        with self.lock:
+            ks=self._keys(ch)
+            # an index entry left behind by a crash between bucket and index writes is skipped
+            cid=next((cid for cid in(self._index(k)[1].get(k)for k in ks)if self.rec(cid)is not None),None)
+            if cid is None:
+                if self.next is None:
+                    on=self._on_disk()+list(self.buckets)
+                    self.next=max([max(self._bucket(max(on)),default=0)]if on else[0])+1
+                cid=self.next;self.next+=1
+                self._bucket(cid//CANON_BUCKET)[cid]={k:v for k,v in ch.items()if k not in('cid','canon')}
+                self.rec(cid)['refs']=0
+            self.rec(cid)['refs']+=1;self.dirty.add(cid//CANON_BUCKET)
+            for k in ks:
+                n,idx=self._index(k);old=idx.get(k)
+                if old!=cid and(old is None or self.rec(old)is None):idx[k]=cid;self.dirty_keys.add(n)
+            return cid
+    def release(self,cid):
+        with self.lock:
+            rec=self.rec(cid)
+            if rec:rec['refs']-=1;self.dirty.add(cid//CANON_BUCKET)
+    def purge(self):
+        """Forget records no list references; called once the referencing shards are on disk.
+        Only loaded buckets can hold such records: refcounts change through acquire/release."""
+        with self.lock:
+            dead=[(b,cid)for b,bk in self.buckets.items()for cid,rec in bk.items()if rec['refs']<=0]
+            if not dead:return
+            for b,cid in dead:
+                for k in self._keys(self.buckets[b][cid]):
+                    n,idx=self._index(k)
+                    if idx.get(k)==cid:del idx[k];self.dirty_keys.add(n)
+                del self.buckets[b][cid];self.dirty.add(b)
+            self.version+=1
+    def save(self):
+        with self.lock:
+            for b in self.dirty:
+                if self.buckets.get(b):self._write(self._file(b),self.buckets[b])
+                elif os.path.exists(self._file(b)):os.remove(self._file(b));self.stamps.pop(self._file(b),None)
+            for n in self.dirty_keys:self._write(self._keyfile(n),self.keys[n])
+            if self.dirty or self.dirty_keys:self.version+=1
+            self.dirty=set();self.dirty_keys=set()
+    def refresh(self):
+        """Forget the loaded buckets and index files that another worker process (the leader, which
+        writes M3U lists) has rewritten since we read them, so the next lookup rereads just those"""
+        with self.lock:
+            if self.dirty or self.dirty_keys:return
+            changed=[p for p,st in self.stamps.items()if file_stamp(p)!=st]
+            for p in changed:
+                del self.stamps[p];m=re.fullmatch(r'canon_(keys_)?(\d+)\.json',os.path.basename(p))
+                (self.keys if m.group(1)else self.buckets).pop(int(m.group(2)),None)
+            if changed:self.next=None;self.version+=1
+    def compact(self,ch):
+        """Shard form of a channel: cid, ref and the fields that differ from its canonical record"""
+        base=self.rec(ch.get('canon'))
+        if base is None:return ch
+        out={'cid':ch['cid']}if 'cid'in ch else{};out['ref']=ch['canon']  # lists imported before cids have none
+        for k in base.keys()|ch.keys():
+            if k not in('refs','cid','canon')and ch.get(k)!=base.get(k):out[k]=ch.get(k)
+        return out
+    def resolve(self,rec):
+        """Inverse of compact: the full channel record, with its canonical id in 'canon'"""
+        if 'ref'not in rec:return rec
+        base=self.rec(rec['ref'])
+        if base is None:log(f"[M3U] Canonical channel {rec['ref']} missing");base={}
+        ch={k:v for k,v in base.items()if k!='refs'}
+        for k,v in rec.items():
+            if k=='ref':ch['canon']=v
+            elif v is None:ch.pop(k,None)
+            else:ch[k]=v
+        return ch
+
+class M3UStore:
+    """m3u/manifest.json holds list metadata (id/name/url/counts/dates); each list's
+    channels and categories live in m3u/list_<id>.json, loaded lazily into a small LRU.
+    Channels are stored as references into the shared ChannelCatalog (m3u/canon_<n>.json).
+    Only one process writes (see Leader); the others notice its writes by the manifest and
+    shard file stamps, the manifest being written after the shard and catalog it refers to."""
+    def __init__(self,path):
+        os.makedirs(path,exist_ok=True)  # shards are written outside the lock, before the manifest is ever loaded
+        self.dir=path;self.manifest_file=os.path.join(path,'manifest.json');self.last_id=0
+        self.meta=None;self.meta_stamp=None;self.cache=collections.OrderedDict();self.stamps={};self.lock=threading.RLock()
+        self.catalog=ChannelCatalog(path);self.list_locks={}
+        self.plock=ProcessLock(os.path.join(path,'.lock'))  # one-time migration of M3U_FILE, whichever worker loads first
+    def _list_lock(self,lid):
+        """Serializes merge and delete of one list (their catalog refcount updates must not interleave)"""
+        with self.lock:return self.list_locks.setdefault(lid,threading.RLock())
+    def _shard(self,lid):return os.path.join(self.dir,f'list_{int(lid)}.json')
+    def _load(self):
+        st=file_stamp(self.manifest_file)
+        if self.meta is not None and st==self.meta_stamp:return
+        if self.meta is not None:self.catalog.refresh()  # rewritten by another worker
+        try:
+            with open(self.manifest_file,'r',encoding='utf-8')as f:self.meta=json.load(f).get('lists',[])
+            self.meta_stamp=st
+        except:
+            self.meta=[]
+            if os.path.exists(M3U_FILE):
+                with self.plock:self._migrate()
+    def _write_manifest(self):
+        write_json_atomic(self.manifest_file,{'lists':self.meta});self.meta_stamp=file_stamp(self.manifest_file)
+    def current_catalog(self):
+        """The catalog, made to reread its records first if another worker changed the lists"""
+        with self.lock:self._load();return self.catalog
+    def _migrate(self):
+        """Split M3U_FILE into manifest and shards; caller holds self.plock"""
+        if os.path.exists(self.manifest_file):self.meta=None;return self._load()  # another worker got there first
+        if not os.path.exists(M3U_FILE):return
+        for l in load_m3u().get('lists',[]):
+            chs=l.pop('channels',[])
+            for i,c in enumerate(chs):c.setdefault('cid',i)  # positions: what readers used as cid until now
+            write_json_atomic(self._shard(l['id']),{'categories':l.pop('categories',[]),'channels':chs,'next_cid':len(chs)})
+            self.meta.append(l)
+        self._write_manifest()
+        os.replace(M3U_FILE,M3U_FILE+'.migrated')
+        log(f"[M3U] Migrated {len(self.meta)} lists from {os.path.basename(M3U_FILE)}")
+    def lists(self):
+        with self.lock:self._load();return[dict(l)for l in self.meta]
+    def get(self,lid):
+        with self.lock:
+            self._load()
+            return next((dict(l)for l in self.meta if l['id']==lid),None)
+    def next_id(self):
+        """A fresh list id; reserved at once, so concurrent imports never share one"""
+        with self.lock:
+            self._load();self.last_id=max([l['id']for l in self.meta]+[self.last_id])+1
+            return self.last_id
+    def shard(self,lid):
+        """{'categories':[...],'channels':[...]} of one list, or None"""
+        with self.lock:
+            self._load()
+            if lid in self.cache and file_stamp(self._shard(lid))==self.stamps.get(lid):
+                self.cache.move_to_end(lid);return self.cache[lid]
+            try:
+                with open(self._shard(lid),'r',encoding='utf-8')as f:sh=json.load(f)
+            except FileNotFoundError:self.cache.pop(lid,None);return None
+            with self.catalog.lock:
+                if any(self.catalog.rec(c['ref'])is None for c in sh.get('channels',[])if 'ref'in c):
+                    self.catalog.refresh()  # the leader saved them after our manifest read
+                chs=sh['channels']=[self.catalog.resolve(c)for c in sh.get('channels',[])]
+                legacy=bool(chs)and'cid'not in chs[0]  # migrated before cids were backfilled
+                if(legacy or any('canon'not in c for c in chs))and leader.runs_background():  # written before the catalog existed; filled in by the writer of M3U lists
+                    if legacy:
+                        for i,c in enumerate(chs):c['cid']=i
+                        sh['next_cid']=len(chs)
+                    for c in chs:
+                        if 'canon'not in c:c['canon']=self.catalog.acquire(c)
+                    self._write_shard(lid,sh)
+            if 'groups' not in sh:sh['groups']=group_index(sh.get('channels',[]))
+            self._remember(lid,sh)
+            return sh
+    def _write_shard(self,lid,sh):
+        """Catalog first (new references must exist before a shard points at them), then the shard
+        with channels in compact form, then drop catalog records nothing references any more"""
+        cat=self.catalog
+        with cat.lock:
+            cat.save();data=dict(sh,channels=[cat.compact(c)for c in sh['channels']])
+        data.pop('groups',None);data.pop('cid_pos',None)
+        write_json_atomic(self._shard(lid),data);cat.purge()
+    def _remember(self,lid,sh):
+        self.cache[lid]=sh;self.cache.move_to_end(lid);self.stamps[lid]=file_stamp(self._shard(lid))
+        while len(self.cache)>M3U_CACHE_LISTS:self.stamps.pop(self.cache.popitem(last=False)[0],None)
+    def save(self,meta,chs=None,cats=None,existing=False):
+        """Insert/update one list's metadata, and its channel shard when chs is given (a fresh
+        import: channels are numbered from cid 1 and the change feed starts at version 1)"""
+        sh=None
+        if chs is not None:
+            for i,c in enumerate(chs,1):c['cid']=i;c['canon']=self.catalog.acquire(c)
+            sh={'categories':cats or[],'channels':chs,'groups':group_index(chs),'version':1,'next_cid':len(chs)+1,'changes':[]}
+            meta['version']=1
+        return self._commit(meta,sh,existing)
+    def merge(self,meta,chs,cats):
+        """Apply a refreshed channel list as a diff against the stored one: channels keep their cid
+        across refreshes (matched by channel_keys), and the adds/updates/removes become a new
+        version in the list's change feed. Returns the change set, or None if the list was deleted."""
+        with self._list_lock(meta['id']):
+            if self.get(meta['id'])is None:return None
+            return self._merge(meta,chs,cats)
+    def _merge(self,meta,chs,cats):
+        old=self.shard(meta['id'])or{};prev={};ochs=old.get('channels',[])
+        base=bool(ochs)and'cid'not in ochs[0];nxt=old.get('next_cid',len(ochs))
+        for i,(k,o)in enumerate(zip(channel_keys(ochs),ochs)):
+            if 'cid'not in o:o=dict(o,cid=i)  # stored without cids: positions, as readers saw them
+            prev[k]=o
+        added,updated,orphans=[],[],[]
+        cat=self.catalog
+        def pair(c,o):
+            c['cid'],c['canon']=o['cid'],o.get('canon')
+            if c!=o:
+                c['canon']=cat.acquire(c);updated.append(c)
+                if o.get('canon')is not None:cat.release(o['canon'])
+        for k,c in zip(channel_keys(chs),chs):
+            o=prev.pop(k,None)
+            if o is None:orphans.append(c)
+            else:pair(c,o)
+        # identities can shift (a tvg-id appears or stops being unique): pair leftovers by URL
+        by_url={}
+        for k,o in prev.items():by_url.setdefault(o['url'],k)
+        for c in orphans:
+            k=by_url.pop(c['url'],None)
+            if k is None:c['cid']=nxt;nxt+=1;c['canon']=cat.acquire(c);added.append(c)
+            else:pair(c,prev.pop(k))
+        ver,cats,feed=old.get('version',0),cats or[],old.get('changes',[])
+        removed=[o['cid']for o in prev.values()]
+        for o in prev.values():
+            if o.get('canon')is not None:cat.release(o['canon'])
+        if base:  # no client holds cids of this list yet: a new baseline, reloaded in full rather than replayed
+            ver+=1;feed=[];removed=[]
+        elif added or updated or removed:
+            ver+=1;feed=(feed+[{'version':ver,'at':datetime.now().strftime('%Y-%m-%d %H:%M'),
+                'added':[c['cid']for c in added],'updated':[c['cid']for c in updated],'removed':removed}])[-M3U_CHANGES_KEEP:]
+        elif cats==old.get('categories')and[c['cid']for c in chs]==[c.get('cid')for c in old.get('channels',[])]:
+            feed=None  # identical channels in the same order: only the metadata changes
+        chg={'version':ver,'added':added,'updated':updated,'removed':removed}
+        meta['version']=ver
+        sh=None if feed is None else{'categories':cats,'channels':chs,'groups':group_index(chs),'version':ver,'next_cid':nxt,'changes':feed}
+        return chg if self._commit(meta,sh,True)else None
+    def _commit(self,meta,sh,existing):
+        """The shard is its own file, so it is written outside the lock and concurrent refreshes of
+        different lists only serialize on the manifest. existing=True drops the update if the
+        list was deleted meanwhile; returns False in that case."""
+        if sh is not None:self._write_shard(meta['id'],sh)
+        with self.lock:
+            self._load()
+            if existing and not any(l['id']==meta['id']for l in self.meta):
+                if sh is not None:
+                    try:os.remove(self._shard(meta['id']))
+                    except FileNotFoundError:pass
+                return False
+            if sh is not None:self._remember(meta['id'],sh)
+            self.meta=[l for l in self.meta if l['id']!=meta['id']]+[meta]
+            self.meta.sort(key=lambda l:l['id'])
+            self._write_manifest()
+            return True
+    def delete(self,lid):
+        with self._list_lock(lid),self.lock:
+            self._load();sh=self.shard(lid)
+            self.meta=[l for l in self.meta if l['id']!=lid];self.cache.pop(lid,None)
+            try:os.remove(self._shard(lid))
+            except FileNotFoundError:pass
+            for c in(sh or{}).get('channels',[]):
+                if c.get('canon')is not None:self.catalog.release(c['canon'])
+            self.catalog.purge();self.catalog.save();self._write_manifest()
+
+m3u_store=M3UStore(M3U_DIR)
 
 def load_analytics():
     try:
         with open(ANALYTICS_FILE,'r',encoding='utf-8')as f:return json.load(f)
     except:return{"views":[],"daily":{},"popular":{}}
 
-def save_analytics(d):
-    with open(ANALYTICS_FILE,'w',encoding='utf-8')as f:json.dump(d,f,ensure_ascii=False,indent=2)
+def save_analytics(d):write_json_atomic(ANALYTICS_FILE,d)
+
+class SharedLimits:
+    """Makes rate_limits and login_attempts hold for the whole server: with several worker processes
+    they are reread from LIMITS_FILE and written back under a ProcessLock around each check, so N
+    workers don't grant N times SEC['rate_limit'] requests and SEC['max_attempts'] guesses.
+    Expired entries are dropped on the way out."""
+    def __init__(self,path):self.path=path;self.plock=ProcessLock(path+'.lock');self.stamp=None
+    def __enter__(self):
+        self.plock.__enter__()
+        try:
+            if leader.multi()and file_stamp(self.path)!=self.stamp:
+                try:
+                    with open(self.path,'r',encoding='utf-8')as f:d=json.load(f)
+                except(OSError,ValueError):d={}
+                rate_limits.clear();rate_limits.update({k:tuple(v)for k,v in d.get('rate',{}).items()})
+                login_attempts.clear();login_attempts.update({k:tuple(v)for k,v in d.get('attempts',{}).items()})
+        except:self.plock.__exit__(None,None,None);raise
+        return self
+    def __exit__(self,*exc):
+        try:
+            if leader.multi():
+                now=time.time()
+                for ip in[ip for ip,(r,s)in rate_limits.items()if now-s>SEC['rate_window']]:del rate_limits[ip]
+                for ip in[ip for ip,(a,l)in login_attempts.items()if not a or l and now>=l]:del login_attempts[ip]
+                write_json_atomic(self.path,{'rate':rate_limits,'attempts':login_attempts});self.stamp=file_stamp(self.path)
+        finally:self.plock.__exit__(*exc)
+
+limits=SharedLimits(LIMITS_FILE)
 
 def check_rate(ip):
     now=time.time()
-    if ip in rate_limits:
-        r,s=rate_limits[ip]
-        if now-s>SEC['rate_window']:rate_limits[ip]=(1,now);return True
-        if r>=SEC['rate_limit']:return False
-        rate_limits[ip]=(r+1,s)
-    else:rate_limits[ip]=(1,now)
-    return True
+    with limits:
+        if ip in rate_limits:
+            r,s=rate_limits[ip]
+            if now-s>SEC['rate_window']:rate_limits[ip]=(1,now);return True
+            if r>=SEC['rate_limit']:return False
+            rate_limits[ip]=(r+1,s)
+        else:rate_limits[ip]=(1,now)
+        return True
 
 def check_attempts(ip):
     now=time.time()
-    if ip in login_attempts:
-        a,l=login_attempts[ip]
-        if l and now<l:return False,int(l-now)
-        if l and now>=l:login_attempts[ip]=(0,None)
-    return True,0
+    with limits:
+        if ip in login_attempts:
+            a,l=login_attempts[ip]
+            if l and now<l:return False,int(l-now)
+            if l and now>=l:login_attempts[ip]=(0,None)
+        return True,0
 
 def record_attempt(ip,ok):
-    if ok:login_attempts[ip]=(0,None)
-    else:
-        a=login_attempts.get(ip,(0,None))[0]+1
-        if a>=SEC['max_attempts']:login_attempts[ip]=(a,time.time()+SEC['lockout_mins']*60)
-        else:login_attempts[ip]=(a,None)
-
-def download_m3u(url):
-    import ssl
+    with limits:
+        if ok:login_attempts[ip]=(0,None)
+        else:
+            a=login_attempts.get(ip,(0,None))[0]+1
+            if a>=SEC['max_attempts']:login_attempts[ip]=(a,time.time()+SEC['lockout_mins']*60)
+            else:login_attempts[ip]=(a,None)
+
+class Bandwidth:
+    """Byte budget shared by all playlist downloads (rate in bytes/s, 0 = unlimited).
+    Each reader reserves its chunk on a common clock and sleeps until its slot; one second of burst."""
+    def __init__(self,rate):self.rate=rate;self.lock=threading.Lock();self.clock=time.monotonic()
+    def take(self,n):
+        if not self.rate:return
+        with self.lock:
+            now=time.monotonic();self.clock=max(self.clock,now-1)+n/self.rate;wait=self.clock-now
+        if wait>0:time.sleep(wait)
+
+bandwidth=Bandwidth(M3U_BANDWIDTH)
+host_slots,host_lock={},threading.Lock()
+
+def host_slot(url):
+    """Semaphore capping concurrent downloads from url's host at M3U_PER_HOST"""
+    h=(urlparse(url).hostname or'').lower()
+    with host_lock:
+        if h not in host_slots:host_slots[h]=threading.BoundedSemaphore(M3U_PER_HOST)
+        return host_slots[h]
+
+def read_chunks(r,size=256*1024):
+    for c in iter(lambda:r.read(size),b''):bandwidth.take(len(c));job_tick(nbytes=len(c));yield c
+
+M3U_VALIDATORS=('etag','last_modified','digest')
+
+def download_m3u(url,prev=None):
+    """Returns (channels,validators): channels is an iterator of channel records, or None when the
+    provider answers 304 or the body's sha256 equals prev['digest'] - nothing to parse then.
+    prev is the list's stored meta; its etag/last_modified are sent as a conditional request."""
     log(f"Processing:{url[:60]}...")
+    prev=prev or{}
     m=re.search(r'(https?://[^/]+)/.*username=([^&]+).*password=([^&]+)',url)
-    if m:return fetch_xtream(m.group(1),m.group(2),m.group(3))
-    return download_regular(url)
+    with host_slot(url):
+        if m:return fetch_xtream(m.group(1),m.group(2),m.group(3),prev)
+        lines,v=download_regular(url,prev)
+    return(None if lines is None else iter_m3u(lines)),v
 
-def fetch_xtream(host,user,pwd):
+# player_api.php stream fields kept in a channel's attrs (epg_channel_id doubles as its tvg-id)
+XTREAM_ATTRS=(('tvg-id','epg_channel_id'),('tvg-chno','num'),('stream_id','stream_id'),('category_id','category_id'),
+    ('tv_archive','tv_archive'),('tv_archive_duration','tv_archive_duration'))
+
+def xtream_open(url,timeout):
     import ssl
     ctx=ssl.create_default_context();ctx.check_hostname=False;ctx.verify_mode=ssl.CERT_NONE
-    h={'User-Agent':'IPTVSmarters'}
+    return urlopen(Request(url,headers={'User-Agent':'IPTVSmarters','Accept-Encoding':'gzip'}),timeout=timeout,context=ctx)
+
+def iter_body(r):
+    """Response body chunks, gunzipped on the fly when the server compressed them"""
+    z=zlib.decompressobj(16+zlib.MAX_WBITS)if(r.headers.get('Content-Encoding')or'').lower()=='gzip'else None
+    with r:
+        for c in read_chunks(r):
+            if z:c=z.decompress(c)
+            if c:yield c
+        if z:
+            c=z.flush()
+            if c:yield c
+
+def iter_json_items(chunks):
+    """Yield the elements of a top-level JSON array as its bytes arrive, holding only the undecoded tail"""
+    dec,jd,it=codecs.getincrementaldecoder('utf-8')(errors='replace'),json.JSONDecoder(),iter(chunks)
+    buf,pos,started,eof='',0,False,False
+    def fill():
+        nonlocal buf,pos,eof
+        c=None if eof else next(it,None)
+        if c is None:eof=True;return False
+        buf=buf[pos:]+dec.decode(c);pos=0;return True
+    while True:
+        while True:
+            while pos<len(buf)and buf[pos]in' \t\r\n':pos+=1
+            if pos<len(buf)or not fill():break
+        if pos>=len(buf):
+            if started:raise ValueError('Truncated JSON array')
+            return
+        ch=buf[pos]
+        if not started:
+            if ch!='[':
+                while fill():pass
+                raise ValueError(f'Expected a JSON array, got: {buf[pos:pos+200]}')
+            started=True;pos+=1;continue
+        if ch==']':return
+        if ch==',':pos+=1;continue
+        try:obj,end=jd.raw_decode(buf,pos)
+        except json.JSONDecodeError:
+            if fill():continue
+            raise
+        # a number cut by a chunk boundary decodes as its prefix ('12' of 1234, '-1' of -1.5e3):
+        # take a value only once what follows it is in, or at EOF
+        if(end>=len(buf)or buf[end]not in' \t\r\n,]')and fill():continue
+        pos=end;yield obj
+
+def fetch_xtream(host,user,pwd,prev):
+    """Live streams of an Xtream panel as channel records straight from the player_api.php JSON.
+    The stream list is gunzipped into a spool while hashing (same digest: nothing to decode),
+    then decoded one array element at a time; same (channels,validators) contract as download_m3u."""
+    api=f"{host}/player_api.php?username={user}&password={pwd}&action="
+    try:cm={str(c.get('category_id')):c.get('category_name')or'Other'for c in iter_json_items(iter_body(xtream_open(api+'get_live_categories',60)))}
+    except Exception:cm={}
+    spool,hs=tempfile.TemporaryFile(),hashlib.sha256(json.dumps(cm,sort_keys=True).encode('utf-8'))
     try:
-        r=urlopen(Request(f"{host}/player_api.php?username={user}&password={pwd}&action=get_live_categories",headers=h),timeout=60,context=ctx)
-        cats=json.loads(r.read().decode('utf-8'))
-        cm={str(c.get('category_id')):c.get('category_name','Other')for c in cats}
-    except:cm={}
-    r=urlopen(Request(f"{host}/player_api.php?username={user}&password={pwd}&action=get_live_streams",headers=h),timeout=120,context=ctx)
-    chs=json.loads(r.read().decode('utf-8'))
-    lines=["#EXTM3U"]
-    for c in chs:
-        n,s,l,g=c.get('name','?'),c.get('stream_id'),c.get('stream_icon',''),cm.get(str(c.get('category_id','')),'Other')
-        lines.append(f'#EXTINF:-1 tvg-logo="{l}" group-title="{g}",{n}')
-        lines.append(f'{host}/live/{user}/{pwd}/{s}.m3u8')
-    return'\n'.join(lines)
-
-def download_regular(url):
+        for c in iter_body(xtream_open(api+'get_live_streams',120)):hs.update(c);spool.write(c)
+    except:spool.close();raise
+    v={'digest':hs.hexdigest()}
+    if v['digest']==prev.get('digest'):spool.close();log(f"[M3U] Unchanged body:{host}");return None,v
+    spool.seek(0)
+    return xtream_records(spool,cm,host,user,pwd),v
+
+def xtream_records(spool,cm,host,user,pwd):
+    with spool:
+        for c in iter_json_items(iter(lambda:spool.read(1024*1024),b'')):
+            sid=c.get('stream_id')
+            ch={'name':str(c.get('name')or'?'),'group':cm.get(str(c.get('category_id','')),'Other'),
+                'url':f'{host}/live/{user}/{pwd}/{sid}.m3u8','logo':c.get('stream_icon')or''}
+            attrs={k:str(c[f])for k,f in XTREAM_ATTRS if c.get(f)not in(None,'')}
+            if attrs:ch['attrs']=attrs
+            yield ch
+
+def download_regular(url,prev):
+    """Spool the playlist to a temp file while hashing it, then hand back a lazy line iterator
+    over the spool (memory stays at one chunk; nothing is parsed when the digest is unchanged)"""
     import ssl
     ctx=ssl.create_default_context();ctx.check_hostname=False;ctx.verify_mode=ssl.CERT_NONE
-    r=urlopen(Request(url,headers={'User-Agent':'VLC/3.0.18','Accept':'*/*'}),timeout=600,context=ctx)
-    d=b''
-    while True:
-        c=r.read(1024*1024)
-        if not c:break
-        d+=c
-    return d.decode('utf-8',errors='ignore')
+    h={'User-Agent':'VLC/3.0.18','Accept':'*/*'}
+    if prev.get('etag'):h['If-None-Match']=prev['etag']
+    if prev.get('last_modified'):h['If-Modified-Since']=prev['last_modified']
+    try:r=urlopen(Request(url,headers=h),timeout=600,context=ctx)
+    except HTTPError as e:
+        if e.code!=304:raise
+        log(f"[M3U] Not modified:{url[:60]}");return None,{k:prev[k]for k in M3U_VALIDATORS if prev.get(k)}
+    v={'etag':r.headers.get('ETag'),'last_modified':r.headers.get('Last-Modified')}
+    spool,hs=tempfile.TemporaryFile(),hashlib.sha256()
+    try:
+        with r:
+            for c in read_chunks(r):hs.update(c);spool.write(c)
+    except:spool.close();raise
+    v['digest']=hs.hexdigest();spool.seek(0)
+    if v['digest']==prev.get('digest'):
+        spool.close();log(f"[M3U] Unchanged body:{url[:60]}");return None,v
+    return iter_lines(spool),v
+
+def set_validators(l,v):
+    for k in M3U_VALIDATORS:
+        if v.get(k):l[k]=v[k]
+        else:l.pop(k,None)
+
+def refresh_m3u(l):
+    """Conditionally re-download one list and merge it into the stored one.
+    Returns its change set (see M3UStore.merge), or None if the playlist was unchanged."""
+    chs,v=download_m3u(l['url'],l);now=datetime.now().strftime('%Y-%m-%d %H:%M')
+    set_validators(l,v);l['checked']=now
+    if chs is None:m3u_store.save(l,existing=True);return None
+    chs,cats=collect_channels(chs)
+    l.update({'channels_count':len(chs),'updated':now})
+    job_tick(phase='saving',channels=len(chs))
+    chg=m3u_store.merge(l,chs,cats)
+    if chg:log(f"[M3U] {l['name']} v{chg['version']}: +{len(chg['added'])} ~{len(chg['updated'])} -{len(chg['removed'])}")
+    return chg
+
+def iter_lines(stream,size=1024*1024):
+    """Decode a byte stream chunk by chunk and yield its lines; only one chunk is held at a time"""
+    dec=codecs.getincrementaldecoder('utf-8')(errors='ignore');tail=''
+    with stream:
+        while True:
+            c=stream.read(size)
+            if not c:break
+            lines=(tail+dec.decode(c)).replace('\r','').split('\n')
+            tail=lines.pop()
+            yield from lines
+    tail+=dec.decode(b'',final=True)
+    if tail:yield tail.replace('\r','')
+
+M3U_INFO=re.compile(r'#EXTINF:[^\s,]*((?:\s*[\w-]+="[^"]*")*)[^,]*(?:,(.*))?')
+M3U_ATTR=re.compile(r'([\w-]+)="([^"]*)"')
+M3U_LAYOUTS={}
+
+def _extinf_keys(segs):
+    """(attribute names, index of the segment holding the title comma) for the text between quoted
+    values, or None if it isn't plain key= layout. Quotes after that comma belong to the title."""
+    ks=[]
+    for j,k in enumerate(segs):
+        if ',' in k:return tuple(ks),j
+        k=k.rstrip()
+        if not k.endswith('='):return None
+        k=k[k.rfind(' ')+1:-1].lower()
+        if not k or not M3U_ATTR.fullmatch(k+'=""'):return None
+        ks.append(k)
+    return tuple(ks),len(segs)
+
+def parse_extinf(line):
+    """Split an #EXTINF line into its key="value" attributes and display name in one scan.
+    Providers repeat the same attribute layout on every line, so after splitting on quotes
+    the key names come from a per-layout cache; anything irregular falls back to the regex."""
+    p=line.split('"')
+    if len(p)&1:
+        segs=tuple(p[0:-1:2]);ks=M3U_LAYOUTS.get(segs,0)
+        if ks==0:
+            if len(M3U_LAYOUTS)>256:M3U_LAYOUTS.clear()
+            ks=M3U_LAYOUTS[segs]=_extinf_keys(segs)
+        if ks is not None:
+            ks,j=ks;t='"'.join(p[2*j:]);i=t.find(',')
+            return dict(zip(ks,p[1:2*j:2])),(t[i+1:].strip()if i>=0 else'')
+    m=M3U_INFO.match(line)
+    if not m:return{},''
+    return{k.lower():v for k,v in M3U_ATTR.findall(m.group(1))},(m.group(2)or'').strip()
+
+def iter_m3u(lines):
+    """Yield a channel record for every #EXTINF entry once its stream URL arrives.
+    #EXTVLCOPT/#KODIPROP/#EXTGRP lines between the two are kept with the channel;
+    attributes other than tvg-name/group-title/tvg-logo are kept under 'attrs'."""
+    info,extra,n=None,None,0
+    for line in lines:
+        if line[:1]=='#':
+            if line.startswith('#EXTINF'):info,extra=line,None
+            elif info is None:pass
+            elif line.startswith('#EXTVLCOPT:'):extra=extra or{};extra.setdefault('vlcopt',[]).append(line[11:].strip())
+            elif line.startswith('#KODIPROP:'):extra=extra or{};extra.setdefault('kodiprop',[]).append(line[10:].strip())
+            elif line.startswith('#EXTGRP:'):extra=extra or{};extra['extgrp']=line[8:].strip()
+            continue
+        if info is None:continue
+        url=line.strip()
+        if not url:continue
+        attrs,title=parse_extinf(info);info=None
+        name=attrs.pop('tvg-name','')or title or f'Ch{n}';group=attrs.pop('group-title','');logo=attrs.pop('tvg-logo','')
+        if extra and not group:group=extra.get('extgrp','')
+        ch={'name':name,'group':group or'Other','url':url,'logo':logo}
+        if attrs:ch['attrs']=attrs
+        if extra:extra.pop('extgrp',None);ch.update(extra)
+        n+=1
+        yield ch
 
 def parse_m3u(content):
-    chs,cats=[],set()
-    lines=content.replace('\r','').split('\n')
-    i=0
-    while i<len(lines):
-        if lines[i].startswith('#EXTINF'):
-            url=lines[i+1].strip()if i+1<len(lines)else''
-            if url and not url.startswith('#'):
-                line=lines[i]
-                m=re.search(r'tvg-name="([^"]*)"',line)
-                name=m.group(1)if m else''
-                if not name:m=re.search(r',([^,]+)$',line);name=m.group(1).strip()if m else f'Ch{len(chs)}'
-                m=re.search(r'group-title="([^"]*)"',line);group=m.group(1)if m else'Other'
-                m=re.search(r'tvg-logo="([^"]*)"',line);logo=m.group(1)if m else''
-                chs.append({'name':name,'group':group,'url':url,'logo':logo})
-                cats.add(group)
-            i+=2
-        else:i+=1
+    """content is playlist text or an iterable of lines"""
+    if isinstance(content,str):content=content.replace('\r','').split('\n')
+    return collect_channels(iter_m3u(content))
+
+def collect_channels(records):
+    """(channels, sorted categories) from a record iterator (iter_m3u, xtream_records)"""
+    chs,cats=[],set();job_tick(phase='parsing')
+    for c in records:
+        chs.append(c);cats.add(c['group'])
+        if not len(chs)%5000:job_tick(channels=len(chs))
     return chs,sorted(cats)
 
 class Scheduler:
@@ -267,6 +1304,8 @@ class Scheduler:
         log("[SCHEDULER] Started")
     def _run(self):
         while self.running:
+            try:gc_uploads()
+            except Exception as e:log(f"[SCHEDULER] Upload GC:{e}")
             try:
                 d=load_data()
                 if d.get('settings',{}).get('m3u_auto_refresh',True):
@@ -274,78 +1313,640 @@ class Scheduler:
                 time.sleep(3600)
             except Exception as e:log(f"[SCHEDULER]{e}");time.sleep(300)
     def _refresh(self,hrs):
-        m=load_m3u();now=datetime.now()
-        for l in m.get('lists',[]):
+        """Refresh every due list on a bounded pool; each list downloads, parses and saves on its
+        own, so a failing or stalled provider only holds its own worker (and host slot)"""
+        now=datetime.now();due=[]
+        for l in m3u_store.lists():
+            last=l.get('checked')or l.get('updated')or l.get('created','')
             try:
-                last=l.get('updated')or l.get('created','')
-                if last and(now-datetime.strptime(last,'%Y-%m-%d %H:%M')).total_seconds()/3600>=hrs:
-                    log(f"[SCHEDULER] Refreshing:{l['name']}")
-                    content=download_m3u(l['url']);chs,cats=parse_m3u(content)
-                    l.update({'channels':chs,'categories':cats,'channels_count':len(chs),'updated':now.strftime('%Y-%m-%d %H:%M')})
-                    save_m3u(m)
-            except Exception as e:log(f"[SCHEDULER] Failed:{e}")
+                if last and(now-datetime.strptime(last,'%Y-%m-%d %H:%M')).total_seconds()/3600>=hrs:due.append(l)
+            except ValueError:due.append(l)
+        if not due:return
+        t=time.time()
+        with ThreadPoolExecutor(max_workers=min(M3U_REFRESH_WORKERS,len(due)),thread_name_prefix='m3u-refresh')as ex:
+            done=sum(ex.map(self._refresh_one,due))
+        log(f"[SCHEDULER] Refreshed {done}/{len(due)} lists in {time.time()-t:.0f}s")
+    def _refresh_one(self,l):
+        log(f"[SCHEDULER] Refreshing:{l['name']}")
+        j=jobs.run_here('refresh',list_id=l['id'],name=l['name'])
+        if j is None:log(f"[SCHEDULER] Already running:{l['name']}");return False
+        if j['state']=='done'and j['result'].get('unchanged'):log(f"[SCHEDULER] Unchanged:{l['name']}")
+        elif j['state']!='done':log(f"[SCHEDULER] Failed:{l['name']}:{j['error']}")
+        return j['state']=='done'
 
 scheduler=Scheduler()
 
+# ============ JOBS ============
+JOBS_DIR=os.path.join(BASE,'jobs')
+JOB_WORKERS=2   # imports/refreshes run at once for API requests
+JOB_KEEP=3600   # seconds a finished job stays visible in /api/jobs
+JOB_POLL=1.0    # seconds between progress writes, and between the leader's looks for jobs other workers queued
+
+class JobCancelled(Exception):pass
+
+job_local=threading.local()
+
+def job_tick(phase=None,nbytes=0,channels=None):
+    """Report progress of the job running on this thread (no-op elsewhere); raises JobCancelled
+    once the job was cancelled, which unwinds the download/parse at its next chunk"""
+    j=getattr(job_local,'job',None)
+    if j is None:return
+    if phase:j['phase']=phase
+    if nbytes:j['bytes']+=nbytes
+    if channels is not None:j['channels']=channels
+    if time.time()-j['saved']>=JOB_POLL:jobs.checkpoint(j)
+    if j['cancel'].is_set():raise JobCancelled()
+
+def pid_alive(pid):
+    try:os.kill(pid,0);return True
+    except PermissionError:return True
+    except OSError:return False
+
+class JobQueue:
+    """M3U imports/refreshes/deletes off the request thread. Each job is also a file in JOBS_DIR, so
+    every worker process can report or cancel it, and with several workers only the leader runs
+    jobs (the others just queue the file). A job's key is ['import', url] or ['refresh'/'delete',
+    list id]: until one has finished (cancelled ones included), submitting the same key returns it instead."""
+    def __init__(self,path,workers):
+        os.makedirs(path,exist_ok=True)
+        self.dir=path;self.jobs={};self.polling=False;self.lock=ProcessLock(os.path.join(path,'.lock'))
+        self.pool=ThreadPoolExecutor(max_workers=workers,thread_name_prefix='job')
+    def _file(self,jid,ext='json'):return os.path.join(self.dir,f'{jid}.{ext}')
+    def _read(self,jid):
+        if not re.fullmatch(r'[0-9a-f]{16}',jid):return None  # ids come from URLs
+        try:
+            with open(self._file(jid),'r',encoding='utf-8')as f:return json.load(f)
+        except(OSError,ValueError):return None
+    def _save(self,j):
+        j['saved']=time.time();write_json_atomic(self._file(j['id']),{k:v for k,v in j.items()if k!='cancel'})
+    def _all(self):
+        """Every job on disk, dropping finished ones older than JOB_KEEP; a job whose process died
+        before it finished is reported failed"""
+        out=[];now=time.time()
+        for fn in os.listdir(self.dir):
+            if not fn.endswith('.json'):continue
+            j=self._read(fn[:-5])
+            if j is None:continue
+            if j['finished']and now-j['finished']>JOB_KEEP:
+                self.jobs.pop(j['id'],None)
+                for ext in('json','cancel'):
+                    try:os.remove(self._file(j['id'],ext))
+                    except FileNotFoundError:pass
+                continue
+            if not j['finished']and j['pid']and j['id']not in self.jobs and not pid_alive(j['pid']):
+                j.update(state='failed',phase='failed',error='Worker exited',finished=now);self._save(j)
+            out.append(j)
+        return out
+    def _new(self,kind,info):
+        """(job, dup): the active job with the same key, or a new queued one; caller holds self.lock"""
+        key=[kind,info.get('url')if kind=='import'else info.get('list_id')]
+        for j in self._all():
+            # a cancelled job holds its key until it has unwound: it may still be inside merge/save
+            if j['key']==key and not j['finished']:return j,True
+        j={'id':secrets.token_hex(8),'kind':kind,'key':key,'state':'queued','phase':'queued','bytes':0,'channels':0,
+           'created':time.time(),'started':None,'finished':None,'result':None,'error':None,'pid':None,**info}
+        self._save(j);return j,False
+    def _claim(self,j):
+        j.update(pid=os.getpid(),cancel=threading.Event());self.jobs[j['id']]=j;self._save(j)
+    def submit(self,kind,**info):
+        """(job, False) for a new job, or (the existing job, True) when one with the same key is active"""
+        with self.lock:
+            j,dup=self._new(kind,info)
+            if dup:return self.get(j['id']),True
+            if leader.runs_background():self._claim(j);self.pool.submit(self._run,j)
+        return self.get(j['id']),False
+    def run_here(self,kind,**info):
+        """Run a job on the calling thread (the scheduler's pool); None if the same key is already active"""
+        with self.lock:
+            j,dup=self._new(kind,info)
+            if dup:return None
+            self._claim(j)
+        self._run(j);return self.get(j['id'])
+    def lead(self):
+        """Run the jobs other workers queue from now on"""
+        if self.polling:return
+        self.polling=True;threading.Thread(target=self._poll,daemon=True,name='job-poll').start()
+    def _poll(self):
+        while True:
+            try:
+                with self.lock:
+                    for j in self._all():
+                        if j['state']=='queued'and j['id']not in self.jobs:self._claim(j);self.pool.submit(self._run,j)
+            except Exception as e:log(f"[JOBS] {e}")
+            time.sleep(JOB_POLL)
+    def checkpoint(self,j):
+        """Publish a running job's progress; picks up a cancel requested from another worker"""
+        if os.path.exists(self._file(j['id'],'cancel')):j['cancel'].set()
+        self._save(j)
+    def _run(self,j):
+        if j['cancel'].is_set()or os.path.exists(self._file(j['id'],'cancel')):self._finish(j,'cancelled');return
+        j.update(state='running',phase='downloading',started=time.time());self._save(j);job_local.job=j
+        try:
+            res=JOB_KINDS[j['kind']](j)
+            j['result']=res if isinstance(res,dict)else{};self._finish(j,'done')
+        except JobCancelled:self._finish(j,'cancelled')
+        except Exception as e:j['error']=str(e);self._finish(j,'failed')
+        finally:job_local.job=None
+    def _finish(self,j,state):
+        j.update(state=state,phase=state,finished=time.time());self._save(j)
+        if state!='done':log(f"[JOBS] {j['kind']} {j.get('name','')} {state}"+(f":{j['error']}"if j['error']else''))
+    def cancel(self,jid):
+        with self.lock:
+            j=self.jobs.get(jid)or self._read(jid)
+            if not j or j['finished']:return self.get(jid)
+            open(self._file(jid,'cancel'),'w').close()
+            if 'cancel'in j:j['cancel'].set()
+            elif j['state']=='queued'and not j['pid']:self._finish(j,'cancelled')  # nobody picked it up yet
+        return self.get(jid)
+    def get(self,jid):
+        j=self.jobs.get(jid)or self._read(jid)
+        return None if j is None else{k:v for k,v in j.items()if k not in('cancel','key','pid','saved')}
+    def recent(self):
+        with self.lock:js=self._all()
+        js.sort(key=lambda j:j['created'],reverse=True)
+        return[self.get(j['id'])for j in js]
+
+jobs=JobQueue(JOBS_DIR,JOB_WORKERS)
+
+def import_m3u_job(url,name):
+    chs,v=download_m3u(url);chs,cats=collect_channels(chs)
+    if not chs:raise ValueError('No channels')
+    job_tick(phase='saving',channels=len(chs))
+    nid=m3u_store.next_id()
+    meta={'id':nid,'name':name,'url':url,'channels_count':len(chs),'created':datetime.now().strftime('%Y-%m-%d %H:%M')}
+    set_validators(meta,v);m3u_store.save(meta,chs,cats)
+    return{'list_id':nid,'channels_count':len(chs),'categories_count':len(cats)}
+
+def refresh_m3u_job(lid):
+    l=m3u_store.get(lid)
+    if not l:raise ValueError('List not found')
+    chg=refresh_m3u(l)
+    if chg is None:return{'list_id':l['id'],'channels_count':l.get('channels_count',0),'version':l.get('version',0),'unchanged':True}
+    return{'list_id':l['id'],'channels_count':l['channels_count'],'version':chg['version'],
+        'added':len(chg['added']),'updated':len(chg['updated']),'removed':len(chg['removed'])}
+
+JOB_KINDS={
+    'import':lambda j:import_m3u_job(j['url'],j['name']),
+    'refresh':lambda j:refresh_m3u_job(j['list_id']),
+    'delete':lambda j:m3u_store.delete(j['list_id']),
+}
+
+# ============ STREAM HEALTH ============
+HEALTH_FILE=os.path.join(BASE,'stream_health.json')
+PROBE_INTERVAL=300      # seconds between probes of a healthy server
+PROBE_BACKOFF_MAX=3600  # a failing server is retried after 2x, 4x... the interval, capped here
+PROBE_TIMEOUT=8
+PROBE_WORKERS=8
+
+def probe_get(url,size):
+    """GET url and read up to size bytes; returns (final url, ms to first byte, data)"""
+    import ssl
+    ctx=ssl.create_default_context();ctx.check_hostname=False;ctx.verify_mode=ssl.CERT_NONE
+    t=time.monotonic()
+    with urlopen(Request(url,headers={'User-Agent':'VLC/3.0.18','Accept':'*/*'}),timeout=PROBE_TIMEOUT,context=ctx)as r:
+        data=r.read(1);ms=round((time.monotonic()-t)*1000)
+        if size>1 and data:data+=r.read(size-1)
+        return r.geturl(),ms,data
+
+def hls_first_uri(text,base):
+    """First URI line of a playlist (a variant in a master playlist, a segment in a media one)"""
+    for line in text.splitlines():
+        line=line.strip()
+        if line and not line.startswith('#'):return urljoin(base,line)
+
+def probe_stream(url):
+    """One health check. HLS: the manifest (following one master->variant hop) and the first byte of
+    its first segment; anything else (embed pages, mp4/ts): the first byte of the URL itself."""
+    if '.m3u8'not in url.lower():return{'ok':True,'ttfb':probe_get(url,1)[1]}
+    u,ms,body=probe_get(url,256*1024);text=body.decode('utf-8','replace')
+    if not text.lstrip().startswith('#EXTM3U'):raise ValueError('Not an HLS playlist')
+    if '#EXT-X-STREAM-INF'in text:
+        v=hls_first_uri(text,u)
+        if not v:raise ValueError('Master playlist has no variants')
+        u,_,body=probe_get(v,256*1024);text=body.decode('utf-8','replace')
+    seg=hls_first_uri(text,u)
+    if not seg:raise ValueError('Playlist has no segments')
+    return{'ok':True,'ttfb':ms,'segment_ttfb':probe_get(seg,1)[1]}
+
+class StreamProber:
+    """Probes every channel server in the background and keeps url -> {ok, ttfb, segment_ttfb, fails,
+    checked, next} in HEALTH_FILE, so /api/data in any process can rank servers by it"""
+    def __init__(self,path):
+        self.path=path;self.health={};self.mtime=None;self.running=False;self.lock=threading.Lock()
+    def start(self):
+        if self.running:return
+        self.running=True
+        threading.Thread(target=self._run,daemon=True).start()
+        log("[PROBE] Started")
+    def _run(self):
+        while self.running:
+            try:self.round()
+            except Exception as e:log(f"[PROBE]{e}")
+            time.sleep(30)
+    def round(self):
+        """Probe the servers that are due, concurrently"""
+        urls={u for c in load_data().get('channels',[])for u in(c.get('servers')or[c.get('iframe')])if u and u.startswith(('http://','https://'))}
+        now=time.time();h=dict(self.status())
+        due=[u for u in urls if h.get(u,{}).get('next',0)<=now]
+        if not due and h.keys()<=urls:return
+        if due:
+            with ThreadPoolExecutor(max_workers=min(PROBE_WORKERS,len(due)),thread_name_prefix='probe')as ex:
+                for u,res in zip(due,ex.map(lambda u:self._probe(u,h.get(u,{})),due)):h[u]=res
+            down=[u for u in due if not h[u]['ok']]
+            log(f"[PROBE] {len(due)-len(down)}/{len(due)} servers up"+(f", down: {', '.join(u[:60]for u in down[:5])}"if down else''))
+        h={u:e for u,e in h.items()if u in urls}
+        with self.lock:
+            write_json_atomic(self.path,h);self.health=h
+            self.mtime=os.stat(self.path).st_mtime_ns
+    def _probe(self,url,prev):
+        now=time.time()
+        try:res=probe_stream(url);res.update(fails=0,next=now+PROBE_INTERVAL)
+        except Exception as e:
+            f=prev.get('fails',0)+1
+            res={'ok':False,'error':str(e)[:200],'fails':f,'next':now+min(PROBE_INTERVAL*2**f,PROBE_BACKOFF_MAX)}
+        res['checked']=now;return res
+    def status(self):
+        """url -> health entry, reloaded when another process has rewritten HEALTH_FILE"""
+        with self.lock:
+            try:m=os.stat(self.path).st_mtime_ns
+            except OSError:return self.health
+            if m!=self.mtime:
+                try:
+                    with open(self.path,'r',encoding='utf-8')as f:self.health=json.load(f)
+                except(OSError,ValueError):pass
+                self.mtime=m
+            return self.health
+    def rank(self,servers):
+        """servers reordered: reachable ones by measured time to first byte, then never probed, then
+        failing ones (fewest failures first); ties keep the admin's order"""
+        h=self.status()
+        def key(u):
+            e=h.get(u)
+            if not e:return(1,0)
+            return(0,e.get('ttfb',0)+e.get('segment_ttfb',0))if e.get('ok')else(2,e.get('fails',0))
+        return sorted(servers,key=key)
+
+prober=StreamProber(HEALTH_FILE)
+
+def with_canon(chs):
+    """Curated channels tagged with the canonical id of the M3U channel one of their servers (or their
+    name) matches, so clients can correlate them with list entries"""
+    cat=m3u_store.current_catalog();out=[]
+    for c in chs:
+        cid=next((x for x in(cat.match({'url':u})for u in c.get('servers')or[c.get('iframe')]if u)if x),None)
+        if cid is None:cid=cat.match({'name':c.get('name')})
+        out.append(dict(c,canon=cid)if cid is not None else c)
+    return out
+
+def rank_servers(chs):
+    """Channels with servers (and iframe, the first server) ordered by prober health; copies only what changes"""
+    out=[]
+    for c in chs:
+        s=c.get('servers')or[]
+        if len(s)>1:
+            ranked=prober.rank(s)
+            if ranked!=s:c=dict(c,servers=ranked,iframe=ranked[0])
+        out.append(c)
+    return out
+
+DEBUG=os.environ.get('ZUZZ_DEBUG','')=='1'  # Django debug pages and tracebacks; never in production
 if not settings.configured:
-    settings.configure(DEBUG=True,SECRET_KEY=secrets.token_hex(32),ROOT_URLCONF=__name__,ALLOWED_HOSTS=['*'],
+    settings.configure(DEBUG=DEBUG,SECRET_KEY=secrets.token_hex(32),ROOT_URLCONF=__name__,ALLOWED_HOSTS=['*'],
         INSTALLED_APPS=['django.contrib.contenttypes','django.contrib.auth'],
         MIDDLEWARE=['django.middleware.common.CommonMiddleware'],
-        DATABASES={'default':{'ENGINE':'django.db.backends.sqlite3','NAME':':memory:'}})
+        DATABASES={'default':{'ENGINE':'django.db.backends.sqlite3','NAME':':memory:'}},
+        # Django only prints unhandled view errors to the console with DEBUG on; keep them visible without it
+        LOGGING={'version':1,'disable_existing_loggers':False,'handlers':{'console':{'class':'logging.StreamHandler'}},
+            'loggers':{'django.request':{'handlers':['console'],'level':'ERROR','propagate':False}}})
 django.setup()
 
-from django.http import JsonResponse,HttpResponse
+from django.http import JsonResponse,HttpResponse,StreamingHttpResponse,FileResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.urls import path
+from django.utils.cache import patch_vary_headers
 
 def get_ip(r):xff=r.META.get('HTTP_X_FORWARDED_FOR');return xff.split(',')[0]if xff else r.META.get('REMOTE_ADDR','0.0.0.0')
 
+# ============ SESSION CACHE ============
+class SessionCache:
+    """token -> (session, expiry timestamp) for one sessions dict of the store.
+    Expiries sit in a min-heap so expired tokens are evicted (and pruned from the
+    store) without scanning; the cache is rebuilt only when the store reloads."""
+    def __init__(self,key):
+        self.key=key;self.map={};self.heap=[];self.loads=-1;self.lock=threading.RLock()
+    def _expiry(self,s):
+        if 'created' not in s:return float('inf')
+        try:return datetime.fromisoformat(s['created']).timestamp()+SEC['session_hours']*3600
+        except(TypeError,ValueError):return 0
+    def _put(self,t,s):
+        e=self._expiry(s);self.map[t]=(s,e)
+        if e!=float('inf'):heapq.heappush(self.heap,(e,t))
+    def _sync(self):
+        if leader.multi():store.get()  # sessions may have been issued or revoked by another worker process
+        st=(store.loads,store.foreign.get(self.key,0))
+        if self.loads!=st:
+            sessions=store.get().get(self.key,{})
+            self.map={};self.heap=[];self.loads=st
+            for t,s in sessions.items():self._put(t,s)
+    def _expire(self,now):
+        gone=[]
+        while self.heap and self.heap[0][0]<=now:
+            e,t=heapq.heappop(self.heap)
+            if t in self.map and self.map[t][1]==e:del self.map[t];gone.append(t)
+        if gone:
+            d=store.get();sessions=d.get(self.key,{})
+            for t in gone:sessions.pop(t,None)
+            save_data(d,*[(self.key,t)for t in gone])
+    def check(self,t):
+        with self.lock:
+            self._sync();self._expire(time.time())
+            e=self.map.get(t)
+            if e is None:
+                # Unknown token: it may have been issued by another process, so re-check the store once
+                store.get();self._sync();e=self.map.get(t)
+            return e[0]if e and e[1]>time.time()else None
+    def add(self,t,s):
+        with self.lock:self._sync();self._put(t,s)
+    def drop(self,t):
+        with self.lock:self._sync();self.map.pop(t,None)
+    def drop_viewer(self,vid):
+        with self.lock:
+            self._sync();self.map={t:e for t,e in self.map.items()if e[0].get('viewer_id')!=vid}
+
+admin_session_cache=SessionCache('sessions')
+viewer_session_cache=SessionCache('viewer_sessions')
+
 def verify_admin(r):
     auth=r.headers.get('Authorization','')
-    if auth.startswith('Bearer '):
-        d=load_data();s=d.get('sessions',{}).get(auth[7:])
-        if s and datetime.now()-datetime.fromisoformat(s.get('created',datetime.now().isoformat()))<timedelta(hours=SEC['session_hours']):return s
+    if auth.startswith('Bearer '):return admin_session_cache.check(auth[7:])
     return None
 
 def verify_viewer(r):
     auth=r.headers.get('Authorization','')
-    if auth.startswith('Bearer '):
-        d=load_data();s=d.get('viewer_sessions',{}).get(auth[7:])
-        if s and datetime.now()-datetime.fromisoformat(s.get('created',datetime.now().isoformat()))<timedelta(hours=SEC['session_hours']):return s
+    if auth.startswith('Bearer '):return viewer_session_cache.check(auth[7:])
     return None
 
-def track_view(ch_id,ch_name,uid=None):
-    a=load_analytics();today=datetime.now().strftime('%Y-%m-%d')
-    a['views'].append({'ch':ch_id,'name':ch_name,'user':uid,'time':datetime.now().isoformat()})
-    a['views']=a['views'][-10000:]
-    if today not in a.get('daily',{}):a['daily'][today]={'views':0,'users':[]}
-    a['daily'][today]['views']+=1
-    if uid and uid not in a['daily'][today]['users']:a['daily'][today]['users'].append(uid)
-    k=str(ch_id)
-    if k not in a.get('popular',{}):a['popular'][k]={'name':ch_name,'views':0}
-    a['popular'][k]['views']+=1
-    save_analytics(a)
-
-def serve_html(name):
-    p=os.path.join(BASE,name)
-    if os.path.exists(p):
-        with open(p,'r',encoding='utf-8')as f:return HttpResponse(f.read(),content_type='text/html;charset=utf-8')
-    return HttpResponse('Not found',status=404)
-
-def home(r):return serve_html('main.html')
-def admin_login(r):return serve_html('login.html')
-def admin_dash(r):return serve_html('admin.html')
-def m3u_page(r):return serve_html('m3u.html')
-def import_events_page(r):return serve_html('import_events.html')
-def m3u_player(r,list_id):
-    p=os.path.join(BASE,'player.html')
-    if os.path.exists(p):
-        with open(p,'r',encoding='utf-8')as f:return HttpResponse(f.read().replace('LIST_ID_HERE',str(list_id)),content_type='text/html;charset=utf-8')
-    return HttpResponse('Not found',status=404)
-def viewer_login_page(r):return serve_html('viewer_login.html')
-def viewer_register_page(r):return serve_html('viewer_register.html')
-def welcome_page(r):return serve_html('welcome.html')
-def payment_page(r):return serve_html('payment.html')
+# ============ ANALYTICS BUFFER ============
+class HyperLogLog:
+    """Fixed-size unique-count sketch: 2048 one-byte registers, ~2.3% standard error.
+    Serialized as base64 of the zlib-compressed registers, so sparse days stay tiny."""
+    P=11;M=1<<P
+    def __init__(self,regs=None):self.regs=bytearray(regs or self.M)
+    @staticmethod
+    def hash(item):return int.from_bytes(hashlib.blake2b(str(item).encode(),digest_size=8).digest(),'big')
+    def add_hash(self,h):
+        i=h>>(64-self.P);r=(64-self.P)-(h&((1<<(64-self.P))-1)).bit_length()+1
+        if r>self.regs[i]:self.regs[i]=r
+    def add(self,item):self.add_hash(self.hash(item))
+    def merge(self,other):self.regs=bytearray(map(max,self.regs,other.regs));return self
+    def count(self):
+        m=self.M;e=0.7213/(1+1.079/m)*m*m/sum(2.0**-r for r in self.regs)
+        zeros=self.regs.count(0)
+        if e<=2.5*m and zeros:e=m*math.log(m/zeros)  # linear counting for small cardinalities
+        return int(round(e))
+    def dump(self):return base64.b64encode(zlib.compress(bytes(self.regs))).decode()
+    @classmethod
+    def load(cls,s):return cls(zlib.decompress(base64.b64decode(s)))
+
+def unique_count(entry):
+    u=entry.get('users',0)
+    return len(u)if isinstance(u,list)else u
+
+def unique_sketch(entry):
+    """The live HyperLogLog of a daily/hourly bucket, migrating legacy 'users' id lists"""
+    h=entry.get('hll')
+    if isinstance(h,HyperLogLog):return h
+    h=HyperLogLog.load(h)if h else HyperLogLog()
+    if isinstance(entry.get('users'),list):
+        for uid in entry['users']:h.add(uid)
+    entry['hll']=h;entry['users']=h.count()
+    return h
+
+ANALYTICS_FLUSH_SECS=5      # persist analytics.json at most this often...
+ANALYTICS_FLUSH_EVENTS=500  # ...or as soon as this many views are queued
+ANALYTICS_RECENT=10000      # size of the recent-views ring buffer
+ANALYTICS_SPOOL=ANALYTICS_FILE+'.spool'  # views tracked by non-leader workers, waiting for the leader to fold them in
+# Rollup levels: granularity -> (analytics.json key, bucket key format, days kept; None = forever)
+ANALYTICS_MAX_POINTS=2000  # cap on buckets returned by one range query
+ROLLUPS={'hour':('hourly','%Y-%m-%d %H',14),'day':('daily','%Y-%m-%d',400),'month':('monthly','%Y-%m',None)}
+
+class Analytics:
+    """Resident analytics aggregates.
+    track() only appends to a deque (atomic, no lock); a background flusher folds
+    queued views into the counters and persists analytics.json. With several worker processes
+    only the leader aggregates: the others append their views to ANALYTICS_SPOOL for it and
+    read the aggregates from analytics.json as the leader last saved it."""
+    def __init__(self):
+        self.queue=collections.deque();self.data=None;self.live={};self.top=None;self.dirty=False;self.lock=threading.Lock()
+        self.wake=threading.Event();self.thread=None;self.stamp=None;self.plock=ProcessLock(ANALYTICS_SPOOL+'.lock')
+    def _load(self):
+        self.stamp=file_stamp(ANALYTICS_FILE);a=load_analytics()
+        a['views']=collections.deque(a.get('views',[]),maxlen=ANALYTICS_RECENT)
+        a.setdefault('daily',{});a.setdefault('hourly',{});a.setdefault('popular',{})
+        if 'monthly' not in a:
+            # Backfill month buckets from the days we already have
+            a['monthly']={}
+            for k,e in a['daily'].items():
+                m=a['monthly'].setdefault(k[:7],{'views':0,'users':0,'ch':{}});m['views']+=e.get('views',0)
+                if e.get('hll')or isinstance(e.get('users'),list):
+                    unique_sketch(m).merge(unique_sketch(e));m['users']=m['hll'].count();self.live[id(e)]=e;self.live[id(m)]=m
+        return a
+    def track(self,ch_id,ch_name,uid=None):
+        self.queue.append((ch_id,ch_name,uid,time.time()))
+        if self.thread is None:self._start()
+        if len(self.queue)>=ANALYTICS_FLUSH_EVENTS:self.wake.set()
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread=threading.Thread(target=self._run,daemon=True,name='analytics-flusher');self.thread.start()
+    def lead(self):
+        """Become the aggregating process: start over from what the previous leader saved"""
+        with self.lock:self.data=None;self.live={};self.top=None
+        self._start()
+    def _spool(self):
+        """Hand queued views to the leader, and reread the aggregates once it saved new ones; caller holds self.lock"""
+        n=0;buf=[]
+        while self.queue:buf.append(json.dumps(self.queue.popleft(),ensure_ascii=False)+'\n');n+=1
+        if buf:
+            with self.plock,open(ANALYTICS_SPOOL,'a',encoding='utf-8')as f:f.write(''.join(buf))
+        if self.data is None or file_stamp(ANALYTICS_FILE)!=self.stamp:self.live={};self.top=None;self.data=self._load()
+        return n
+    def _unspool(self):
+        """Queue the views other workers spooled; caller holds self.lock"""
+        try:
+            if not os.path.getsize(ANALYTICS_SPOOL):return
+        except OSError:return
+        with self.plock,open(ANALYTICS_SPOOL,'r+',encoding='utf-8')as f:lines=f.readlines();f.truncate(0)
+        for line in lines:
+            try:self.queue.append(tuple(json.loads(line)))
+            except ValueError:pass  # torn by a worker killed mid-write
+    def _drain(self):
+        """Fold queued views into the aggregates; caller holds self.lock"""
+        if not leader.runs_background():return self._spool()
+        if self.data is None:self.data=self._load()
+        self._unspool()
+        a,n,live=self.data,0,{}
+        while self.queue:
+            ch_id,ch_name,uid,ts=self.queue.popleft();n+=1
+            when=datetime.fromtimestamp(ts)
+            a['views'].append({'ch':ch_id,'name':ch_name,'user':uid,'time':when.isoformat()})
+            h=HyperLogLog.hash(uid)if uid else None;k=str(ch_id)
+            for store_key,fmt,_ in ROLLUPS.values():
+                e=a[store_key].setdefault(when.strftime(fmt),{'views':0,'users':0});e['views']+=1
+                ch=e.setdefault('ch',{});ch[k]=ch.get(k,0)+1
+                if h is not None:unique_sketch(e).add_hash(h);live[id(e)]=e
+            p=a['popular'].setdefault(k,{'name':ch_name,'views':0})
+            p['views']+=1
+        for e in live.values():e['users']=e['hll'].count()
+        self.live.update(live)
+        if n:self.top=None;self.dirty=True
+        return n
+    def _expire(self):
+        """Apply the ROLLUPS retention policy; caller holds self.lock"""
+        now=datetime.now()
+        for store_key,fmt,days in ROLLUPS.values():
+            if days is None:continue
+            cutoff=(now-timedelta(days=days)).strftime(fmt);bucket=self.data[store_key]
+            for k in[k for k in bucket if k<cutoff]:self.live.pop(id(bucket.pop(k)),None)
+    def popular(self,n=10):
+        """All-time top channels, re-sorted only after new views arrive"""
+        with self.lock:
+            self._drain()
+            if self.top is None or len(self.top)<n:
+                self.top=heapq.nlargest(max(n,10),self.data['popular'].items(),key=lambda x:x[1]['views'])
+            return[{'name':v['name'],'views':v['views']}for k,v in self.top[:n]]
+    def series(self,gran,start,end,channel=None):
+        """Precomputed buckets of one granularity between two datetimes (inclusive), zero-filled"""
+        store_key,fmt,_=ROLLUPS[gran]
+        with self.lock:
+            self._drain();bucket=self.data[store_key]
+            t=start.replace(minute=0,second=0,microsecond=0)
+            if gran!='hour':t=t.replace(hour=0)
+            if gran=='month':t=t.replace(day=1)
+            out,chans,uniq=[],collections.Counter(),HyperLogLog()
+            while t<=end and len(out)<ANALYTICS_MAX_POINTS:
+                k=t.strftime(fmt);e=bucket.get(k)or{}
+                views=e.get('ch',{}).get(str(channel),0)if channel is not None else e.get('views',0)
+                out.append({'t':k,'views':views,'users':unique_count(e)if channel is None else None})
+                chans.update(e.get('ch',{}))
+                if e.get('hll')or isinstance(e.get('users'),list):uniq.merge(unique_sketch(e));self.live[id(e)]=e
+                if gran=='hour':t+=timedelta(hours=1)
+                elif gran=='day':t+=timedelta(days=1)
+                else:t=(t+timedelta(days=32)).replace(day=1)
+            names=self.data['popular']
+            top=[{'id':k,'name':names.get(k,{}).get('name',k),'views':v}for k,v in chans.most_common(10)]
+            return{'series':out,'total_views':sum(p['views']for p in out),'unique_users':uniq.count(),'top':top}
+    def snapshot(self):
+        with self.lock:self._drain();return self.data
+    def flush(self):
+        with self.lock:
+            self._drain()
+            if not self.dirty:return
+            self.dirty=False;self._expire()
+            for e in self.live.values():
+                if isinstance(e.get('hll'),HyperLogLog):e['hll']=e['hll'].dump()
+            self.live={}
+            a=dict(self.data);a['views']=list(a['views'])
+            try:save_analytics(a);self.stamp=file_stamp(ANALYTICS_FILE)
+            except:self.dirty=True;raise
+    def _run(self):
+        while True:
+            self.wake.wait(ANALYTICS_FLUSH_SECS);self.wake.clear()
+            try:self.flush()
+            except Exception as e:log(f"[ANALYTICS] ERROR saving: {e}")
+
+analytics=Analytics()
+atexit.register(analytics.flush)
+
+def track_view(ch_id,ch_name,uid=None):analytics.track(ch_id,ch_name,uid)
+
+# ============ PAGE CACHE ============
+try:import brotli  # optional; pages are also precompressed with it when installed
+except ImportError:brotli=None
+PAGE_CACHE_MAX=256  # rendered pages kept (one per file, player page per list id)
+PAGE_CACHE_CONTROL='no-cache'  # HTML changes with deploys/settings: always revalidate, which is a 304 when unchanged
+
+def make_page(body,ctype='text/html;charset=utf-8'):
+    """Bytes plus their precompressed variants and a strong ETag, built once per content"""
+    if isinstance(body,str):body=body.encode('utf-8')
+    tag=hashlib.sha256(body).hexdigest()[:32];p={'ctype':ctype,'tag':tag,'identity':body}
+    if len(body)>=512:
+        gz=gzip.compress(body,9,mtime=0)
+        if len(gz)<len(body):p['gzip']=gz
+        if brotli:
+            br=brotli.compress(body)
+            if len(br)<len(p.get('gzip',body)):p['br']=br
+    return p
+
+def accepted_encodings(r):
+    """Codings the client accepts (q>0)"""
+    out=set()
+    for part in r.META.get('HTTP_ACCEPT_ENCODING','').split(','):
+        name,_,params=part.strip().partition(';');q=params.strip()
+        if name and not(q.startswith('q=')and q[2:].strip('0.')==''):out.add(name.strip().lower())
+    return out
+
+def page_response(r,p,cache_control=PAGE_CACHE_CONTROL):
+    """Serve a make_page() result: best coding the client takes, strong per-coding ETag, 304 on If-None-Match"""
+    acc=accepted_encodings(r);enc=next((e for e in('br','gzip')if e in p and e in acc),'identity')
+    etag=f'"{p["tag"]}"'if enc=='identity'else f'"{p["tag"]}-{enc}"'
+    inm=r.META.get('HTTP_IF_NONE_MATCH','')
+    if inm and(inm.strip()=='*'or p['tag']in{t.strip().lstrip('W/').strip('"').split('-')[0]for t in inm.split(',')}):
+        resp=HttpResponse(status=304)
+    else:
+        resp=HttpResponse(p[enc],content_type=p['ctype'])
+        if enc!='identity':resp['Content-Encoding']=enc
+        resp['Content-Length']=str(len(p[enc]))
+    resp['ETag']=etag;resp['Cache-Control']=cache_control
+    if 'gzip'in p or 'br'in p:resp['Vary']='Accept-Encoding'
+    return resp
+
+class PageCache:
+    """key -> (stamp, page); a page is rebuilt when the stamp its source reports differs"""
+    def __init__(self,size=PAGE_CACHE_MAX):
+        self.lock=threading.Lock();self.items=collections.OrderedDict();self.size=size
+    def get(self,key,stamp,build):
+        with self.lock:
+            hit=self.items.get(key)
+            if hit and hit[0]==stamp:self.items.move_to_end(key);return hit[1]
+        p=build()
+        with self.lock:
+            self.items[key]=(stamp,p);self.items.move_to_end(key)
+            while len(self.items)>self.size:self.items.popitem(last=False)
+        return p
+    def clear(self):
+        with self.lock:self.items.clear()
+
+page_cache=PageCache()
+
+def file_stamp(p):
+    try:st=os.stat(p);return(st.st_mtime_ns,st.st_size)
+    except OSError:return None
+
+def read_text(p):
+    with open(p,'r',encoding='utf-8')as f:return f.read()
+
+def serve_html(r,name,fill=None):
+    """An HTML file from BASE through the page cache. fill, a {placeholder: value} dict, makes
+    a page of its own per distinct value set"""
+    p=os.path.join(BASE,name);st=file_stamp(p)
+    if st is None:return HttpResponse('Not found',status=404)
+    def build():
+        s=read_text(p)
+        for k,v in(fill or{}).items():s=s.replace(k,v)
+        return make_page(s)
+    return page_response(r,page_cache.get((name,tuple(sorted((fill or{}).items()))),st,build))
+
+def home(r):return serve_html(r,'main.html')
+def admin_login(r):return serve_html(r,'login.html')
+def admin_dash(r):return serve_html(r,'admin.html')
+def m3u_page(r):return serve_html(r,'m3u.html')
+def import_events_page(r):return serve_html(r,'import_events.html')
+def m3u_player(r,list_id):return serve_html(r,'player.html',{'LIST_ID_HERE':str(list_id)})
+def viewer_login_page(r):return serve_html(r,'viewer_login.html')
+def viewer_register_page(r):return serve_html(r,'viewer_register.html')
+def welcome_page(r):return serve_html(r,'welcome.html')
+def payment_page(r):return serve_html(r,'payment.html')
 
 def manifest(r):return JsonResponse({"name":"ZUZZ TV","short_name":"ZUZZ","start_url":"/","display":"standalone","background_color":"#0d1117","theme_color":"#ff5722","icons":[{"src":"/icon-192.png","sizes":"192x192","type":"image/png"},{"src":"/icon-512.png","sizes":"512x512","type":"image/png"}]})
 def sw(r):return HttpResponse("const C='zuzz-v1';self.addEventListener('install',e=>e.waitUntil(caches.open(C).then(c=>c.addAll(['/']))));self.addEventListener('fetch',e=>{if(e.request.method!=='GET')return;e.respondWith(caches.match(e.request).then(r=>r||fetch(e.request)));});",content_type='application/javascript')
@@ -365,13 +1966,14 @@ def api_login(r):
                 if u['username']==b.get('username')and u['password']==h:
                     t=secrets.token_hex(32)
                     d['sessions'][t]={'user_id':u['id'],'username':u['username'],'role':u.get('role','editor'),'created':datetime.now().isoformat(),'ip':ip}
-                    save_data(d);record_attempt(ip,True);log(f"[AUTH] Admin:{u['username']}")
+                    admin_session_cache.add(t,d['sessions'][t]);save_data(d,('sessions',t));record_attempt(ip,True);log(f"[AUTH] Admin:{u['username']}")
                     return JsonResponse({'success':True,'token':t,'username':u['username'],'role':u.get('role')})
             record_attempt(ip,False);return JsonResponse({'success':False,'error':'Invalid credentials'})
         except Exception as e:return JsonResponse({'success':False,'error':str(e)})
     return JsonResponse({'error':'POST only'})
 
 @csrf_exempt
+@transactional
 def api_viewer_register(r):
     if r.method=='POST':
         ip=get_ip(r)
@@ -389,11 +1991,11 @@ def api_viewer_register(r):
             if len(pwd)<6:return JsonResponse({'success':False,'error':'Password min 6 chars'})
             
             d=load_data()
-            for v in d.get('viewers',[]):
+            for v in find_viewers(user,email):
                 if v['username'].lower()==user.lower():return JsonResponse({'success':False,'error':'Username exists'})
-                if v['email']==email:return JsonResponse({'success':False,'error':'Email registered'})
+                if v.get('email','').lower()==email:return JsonResponse({'success':False,'error':'Email registered'})
             
-            vid=max([v['id']for v in d.get('viewers',[])],default=0)+1
+            vid=store.next_id('viewers')
             hashed_pwd=hashlib.sha256(pwd.encode()).hexdigest()
             
             new_viewer={
@@ -414,8 +2016,9 @@ def api_viewer_register(r):
             if 'viewer_sessions' not in d:
                 d['viewer_sessions']={}
             d['viewer_sessions'][t]={'viewer_id':vid,'username':user,'created':datetime.now().isoformat()}
+            viewer_session_cache.add(t,d['viewer_sessions'][t])
             
-            save_data(d)
+            save_data(d,('viewers',vid),('viewer_sessions',t))
             log(f"[REGISTER] Success: {user} (ID:{vid})")
             
             # Verify save
@@ -447,7 +2050,7 @@ def api_viewer_login(r):
             
             log(f"[LOGIN] Viewers in DB: {len(d.get('viewers',[]))}")
             
-            for v in d.get('viewers',[]):
+            for v in find_viewers(login,login):
                 log(f"[LOGIN] Checking: {v['username']} / {v['email']}")
                 if(v['username'].lower()==login or v['email']==login):
                     if v['password']==h:
@@ -455,7 +2058,8 @@ def api_viewer_login(r):
                         if 'viewer_sessions' not in d:
                             d['viewer_sessions']={}
                         d['viewer_sessions'][t]={'viewer_id':v['id'],'username':v['username'],'created':datetime.now().isoformat()}
-                        save_data(d)
+                        viewer_session_cache.add(t,d['viewer_sessions'][t])
+                        save_data(d,('viewer_sessions',t))
                         record_attempt(ip,True)
                         sub=None
                         if v.get('subscription'):
@@ -478,8 +2082,8 @@ def api_viewer_login(r):
 def api_viewer_logout(r):
     auth=r.headers.get('Authorization','')
     if auth.startswith('Bearer '):
-        d=load_data()
-        if auth[7:]in d.get('viewer_sessions',{}):del d['viewer_sessions'][auth[7:]];save_data(d)
+        d=load_data();viewer_session_cache.drop(auth[7:])
+        if auth[7:]in d.get('viewer_sessions',{}):del d['viewer_sessions'][auth[7:]];save_data(d,('viewer_sessions',auth[7:]))
     return JsonResponse({'success':True})
 
 # ============ PASSWORD RESET SYSTEM ============
@@ -589,8 +2193,7 @@ def api_forgot_password(r):
             return JsonResponse({'success': False, 'error': 'Invalid email address'})
         
         # Check if email exists
-        d = load_data()
-        viewer = next((v for v in d.get('viewers', []) if v.get('email', '').lower() == email), None)
+        viewer = next(iter(find_viewers(email=email)), None)
         
         if not viewer:
             # Don't reveal if email exists or not for security
@@ -703,11 +2306,10 @@ def api_reset_password(r):
         
         # Update password
         d = load_data()
-        for v in d.get('viewers', []):
-            if v.get('email', '').lower() == email:
-                v['password'] = hashlib.sha256(password.encode()).hexdigest()
-                break
-        save_data(d)
+        for v in find_viewers(email=email):
+            v['password'] = hashlib.sha256(password.encode()).hexdigest()
+            save_data(d, ('viewers', v['id']))
+            break
         
         # Clean up token
         del tokens[email]
@@ -734,7 +2336,8 @@ def api_viewer_delete(r):
             d['viewers']=[v for v in d.get('viewers',[]) if v['id']!=vid]
             # Remove their sessions
             d['viewer_sessions']={k:v for k,v in d.get('viewer_sessions',{}).items() if v.get('viewer_id')!=vid}
-            save_data(d)
+            viewer_session_cache.drop_viewer(vid)
+            save_data(d,('viewers',vid),'viewer_sessions')
             log(f"[ADMIN] Deleted viewer ID: {vid}")
             return JsonResponse({'success':True})
         except Exception as e:
@@ -742,6 +2345,7 @@ def api_viewer_delete(r):
     return JsonResponse({'error':'POST only'})
 
 @csrf_exempt
+@transactional
 def api_viewer_manage(r):
     """Add or edit viewer (admin only)"""
     if r.method=='POST':
@@ -763,16 +2367,16 @@ def api_viewer_manage(r):
             
             if vid:
                 # Edit existing viewer
-                viewer=next((v for v in d.get('viewers',[]) if v['id']==vid),None)
+                viewer=get_viewer(vid)
                 if not viewer:
                     return JsonResponse({'success':False,'error':'Viewer not found'})
                 
                 # Check username/email not taken by others
-                for v in d.get('viewers',[]):
+                for v in find_viewers(username,email):
                     if v['id']!=vid:
                         if v['username'].lower()==username.lower():
                             return JsonResponse({'success':False,'error':'Username exists'})
-                        if v['email']==email:
+                        if v.get('email','').lower()==email:
                             return JsonResponse({'success':False,'error':'Email exists'})
                 
                 viewer['username']=username
@@ -801,13 +2405,13 @@ def api_viewer_manage(r):
                     return JsonResponse({'success':False,'error':'Password min 6 chars'})
                 
                 # Check username/email not taken
-                for v in d.get('viewers',[]):
+                for v in find_viewers(username,email):
                     if v['username'].lower()==username.lower():
                         return JsonResponse({'success':False,'error':'Username exists'})
-                    if v['email']==email:
+                    if v.get('email','').lower()==email:
                         return JsonResponse({'success':False,'error':'Email exists'})
                 
-                new_id=max([v['id'] for v in d.get('viewers',[])],default=0)+1
+                new_id=store.next_id('viewers')
                 new_viewer={
                     'id':new_id,
                     'username':username,
@@ -823,7 +2427,7 @@ def api_viewer_manage(r):
                 d['viewers'].append(new_viewer)
                 log(f"[ADMIN] Created viewer: {username} (ID:{new_id})")
             
-            save_data(d)
+            save_data(d,'viewers')
             return JsonResponse({'success':True})
         except Exception as e:
             log(f"[ADMIN] Viewer manage error: {e}")
@@ -834,7 +2438,7 @@ def api_viewer_manage(r):
 def api_viewer_profile(r):
     s=verify_viewer(r)
     if not s:return JsonResponse({'success':False,'error':'Unauthorized'},status=401)
-    d=load_data();v=next((x for x in d.get('viewers',[])if x['id']==s['viewer_id']),None)
+    d=load_data();v=get_viewer(s['viewer_id'])
     if not v:return JsonResponse({'success':False,'error':'Not found'})
     if r.method=='GET':
         sub=None
@@ -846,14 +2450,14 @@ def api_viewer_profile(r):
         b=json.loads(r.body)
         if b.get('email'):v['email']=b['email'].lower()
         if b.get('password')and len(b['password'])>=6:v['password']=hashlib.sha256(b['password'].encode()).hexdigest()
-        save_data(d);return JsonResponse({'success':True})
+        save_data(d,('viewers',v['id']));return JsonResponse({'success':True})
     return JsonResponse({'error':'Method not allowed'})
 
 @csrf_exempt
 def api_favorites(r):
     s=verify_viewer(r)
     if not s:return JsonResponse({'success':False,'error':'Unauthorized'},status=401)
-    d=load_data();v=next((x for x in d.get('viewers',[])if x['id']==s['viewer_id']),None)
+    d=load_data();v=get_viewer(s['viewer_id'])
     if not v:return JsonResponse({'success':False,'error':'Not found'})
     if r.method=='GET':return JsonResponse({'success':True,'favorites':v.get('favorites',[])})
     elif r.method=='POST':
@@ -861,7 +2465,7 @@ def api_favorites(r):
         if action=='add'and ch_id not in favs:favs.append(ch_id)
         elif action=='remove'and ch_id in favs:favs.remove(ch_id)
         elif action=='toggle':favs.remove(ch_id)if ch_id in favs else favs.append(ch_id)
-        v['favorites']=favs;save_data(d);return JsonResponse({'success':True,'favorites':favs})
+        v['favorites']=favs;save_data(d,('viewers',v['id']));return JsonResponse({'success':True,'favorites':favs})
     return JsonResponse({'error':'Method not allowed'})
 
 @csrf_exempt
@@ -874,6 +2478,7 @@ def api_plans(r):
     })
 
 @csrf_exempt
+@transactional
 def api_plan(r):
     """Add or update a plan (admin only)"""
     if r.method=='POST':
@@ -914,14 +2519,14 @@ def api_plan(r):
                 log(f"[ADMIN] Updated plan: {name}")
             else:
                 # Add new
-                new_id=max([p['id'] for p in d['plans']],default=0)+1
+                new_id=store.next_id('plans')
                 new_plan={'id':new_id,'name':name,'days':days,'price':price,'devices':devices,'featured':featured}
                 if original_price:
                     new_plan['original_price']=float(original_price)
                 d['plans'].append(new_plan)
                 log(f"[ADMIN] Created plan: {name} (ID:{new_id})")
             
-            save_data(d)
+            save_data(d,'plans')
             return JsonResponse({'success':True})
         except Exception as e:
             return JsonResponse({'success':False,'error':str(e)})
@@ -937,7 +2542,7 @@ def api_plan_delete(r):
             plan_id=b.get('id')
             d=load_data()
             d['plans']=[p for p in d.get('plans',[]) if p['id']!=plan_id]
-            save_data(d)
+            save_data(d,'plans')
             log(f"[ADMIN] Deleted plan ID: {plan_id}")
             return JsonResponse({'success':True})
         except Exception as e:
@@ -945,6 +2550,7 @@ def api_plan_delete(r):
     return JsonResponse({'error':'POST only'})
 
 @csrf_exempt
+@transactional
 def api_subscribe(r):
     if r.method=='POST':
         s=verify_viewer(r)
@@ -953,27 +2559,45 @@ def api_subscribe(r):
             b=json.loads(r.body);plan_id,order_id=b.get('plan_id'),b.get('paypal_order_id');d=load_data()
             plan=next((p for p in d.get('plans',[])if p['id']==plan_id),None)
             if not plan:return JsonResponse({'success':False,'error':'Plan not found'})
-            v=next((x for x in d.get('viewers',[])if x['id']==s['viewer_id']),None)
+            v=get_viewer(s['viewer_id'])
             if not v:return JsonResponse({'success':False,'error':'Viewer not found'})
             exp=datetime.now()+timedelta(days=plan['days'])
             v['subscription']={'plan_id':plan['id'],'plan_name':plan['name'],'price':plan['price'],'devices':plan.get('devices',1),'started':datetime.now().isoformat(),'expires':exp.isoformat(),'paypal_order_id':order_id}
-            d.setdefault('subscriptions',[]).append({'id':len(d.get('subscriptions',[]))+1,'viewer_id':v['id'],'viewer':v['username'],'plan':plan['name'],'price':plan['price'],'paypal':order_id,'created':datetime.now().isoformat()})
-            save_data(d);log(f"[SUB]{v['username']}->{plan['name']}")
+            sid=store.next_id('subscriptions')
+            d.setdefault('subscriptions',[]).append({'id':sid,'viewer_id':v['id'],'viewer':v['username'],'plan':plan['name'],'price':plan['price'],'paypal':order_id,'created':datetime.now().isoformat()})
+            save_data(d,('viewers',v['id']),('subscriptions',sid));log(f"[SUB]{v['username']}->{plan['name']}")
             return JsonResponse({'success':True,'subscription':v['subscription']})
         except Exception as e:return JsonResponse({'success':False,'error':str(e)})
     return JsonResponse({'error':'POST only'})
 
-@csrf_exempt
-def api_data(r):
-    d=load_data();req_sub=d.get('settings',{}).get('require_subscription',False);vs=verify_viewer(r);has_sub=False
+def viewer_channels(r,d):
+    """(require_subscription, has_subscription, channels this caller may see)"""
+    req_sub=d.get('settings',{}).get('require_subscription',False);vs=verify_viewer(r);has_sub=False
     if vs:
-        v=next((x for x in d.get('viewers',[])if x['id']==vs['viewer_id']),None)
+        v=get_viewer(vs['viewer_id'])
         if v and v.get('subscription'):
             if datetime.fromisoformat(v['subscription']['expires'])>datetime.now():has_sub=True
     chs=d.get('channels',[])
     if req_sub and not has_sub and not verify_admin(r):chs=chs[:3]
-    users=[{'id':u['id'],'username':u['username'],'role':u['role'],'created':u.get('created','')}for u in d.get('users',[])]
-    return JsonResponse({'categories':d.get('categories',[]),'channels':chs,'users':users,'require_subscription':req_sub,'has_subscription':has_sub})
+    return req_sub,has_sub,chs
+
+data_cache=PageCache(8)  # serialized /api/data payloads, one per audience variant
+
+@csrf_exempt
+def api_data(r):
+    """Served from data_cache: the payload differs only by whether the channel list is truncated and
+    has_subscription, and is rebuilt when channels/categories/users/settings, server health or the
+    canonical catalog change. Strong ETag, 304 on If-None-Match."""
+    d=load_data();req_sub,has_sub,chs=viewer_channels(r,d);prober.status()
+    limited=len(chs)<len(d.get('channels',[]))
+    stamp=(store.version_of('channels','categories','users','settings'),prober.mtime,m3u_store.current_catalog().version)
+    def build():
+        users=[{'id':u['id'],'username':u['username'],'role':u['role'],'created':u.get('created','')}for u in d.get('users',[])]
+        return make_page(json.dumps({'categories':d.get('categories',[]),'channels':rank_servers(with_canon(chs)),'users':users,
+            'require_subscription':req_sub,'has_subscription':has_sub}),'application/json')
+    resp=page_response(r,data_cache.get((limited,has_sub),stamp,build),'private, no-cache')
+    patch_vary_headers(resp,('Authorization',))
+    return resp
 
 @csrf_exempt
 def api_track(r):
@@ -983,6 +2607,7 @@ def api_track(r):
     return JsonResponse({'success':True})
 
 @csrf_exempt
+@transactional
 def api_channel(r):
     if r.method=='POST':
         if not verify_admin(r):return JsonResponse({'success':False,'error':'Auth'})
@@ -994,19 +2619,20 @@ def api_channel(r):
             for c in d['channels']:
                 if c['id']==b['id']:c.update({'name':b['name'],'servers':servers,'iframe':servers[0]if servers else'','icon':b.get('icon','📺'),'category_id':b.get('category_id',1)});break
         else:
-            nid=max([c['id']for c in d['channels']],default=0)+1
+            nid=store.next_id('channels')
             d['channels'].append({'id':nid,'name':b['name'],'servers':servers,'iframe':servers[0]if servers else'','icon':b.get('icon','📺'),'category_id':b.get('category_id',1)})
-        save_data(d);return JsonResponse({'success':True})
+        save_data(d,'channels');return JsonResponse({'success':True})
     return JsonResponse({'error':'POST'})
 
 @csrf_exempt
 def api_channel_del(r):
     if r.method=='POST':
         if not verify_admin(r):return JsonResponse({'success':False})
-        b=json.loads(r.body);d=load_data();d['channels']=[c for c in d['channels']if c['id']!=b['id']];save_data(d);return JsonResponse({'success':True})
+        b=json.loads(r.body);d=load_data();d['channels']=[c for c in d['channels']if c['id']!=b['id']];save_data(d,'channels');return JsonResponse({'success':True})
     return JsonResponse({'error':'POST'})
 
 @csrf_exempt
+@transactional
 def api_category(r):
     if r.method=='POST':
         if not verify_admin(r):return JsonResponse({'success':False})
@@ -1015,9 +2641,9 @@ def api_category(r):
             for c in d['categories']:
                 if c['id']==b['id']:c.update({'name':b['name'],'icon':b.get('icon','🏷️')});break
         else:
-            nid=max([c['id']for c in d['categories']],default=0)+1
+            nid=store.next_id('categories')
             d['categories'].append({'id':nid,'name':b['name'],'icon':b.get('icon','🏷️')})
-        save_data(d);return JsonResponse({'success':True})
+        save_data(d,'categories');return JsonResponse({'success':True})
     return JsonResponse({'error':'POST'})
 
 @csrf_exempt
@@ -1028,10 +2654,11 @@ def api_category_del(r):
         for c in d['channels']:
             if c['category_id']==b['id']:c['category_id']=1
         if b['id']!=1:d['categories']=[c for c in d['categories']if c['id']!=b['id']]
-        save_data(d);return JsonResponse({'success':True})
+        save_data(d,'channels','categories');return JsonResponse({'success':True})
     return JsonResponse({'error':'POST'})
 
 @csrf_exempt
+@transactional
 def api_user(r):
     if r.method=='POST':
         if not verify_admin(r):return JsonResponse({'success':False})
@@ -1043,9 +2670,9 @@ def api_user(r):
                 break
         else:
             if not b.get('password'):return JsonResponse({'success':False,'error':'Password required'})
-            nid=max([u['id']for u in d['users']],default=0)+1
+            nid=store.next_id('users')
             d['users'].append({'id':nid,'username':b['username'],'password':hashlib.sha256(b['password'].encode()).hexdigest(),'role':b.get('role','editor'),'created':datetime.now().strftime('%Y-%m-%d')})
-        save_data(d);return JsonResponse({'success':True})
+        save_data(d,'users');return JsonResponse({'success':True})
     return JsonResponse({'error':'POST'})
 
 @csrf_exempt
@@ -1054,11 +2681,11 @@ def api_user_del(r):
         if not verify_admin(r):return JsonResponse({'success':False})
         b=json.loads(r.body)
         if b['id']==1:return JsonResponse({'success':False,'error':'Cannot delete admin'})
-        d=load_data();d['users']=[u for u in d['users']if u['id']!=b['id']];save_data(d);return JsonResponse({'success':True})
+        d=load_data();d['users']=[u for u in d['users']if u['id']!=b['id']];save_data(d,'users');return JsonResponse({'success':True})
     return JsonResponse({'error':'POST'})
 
 @csrf_exempt
-def api_m3u_lists(r):m=load_m3u();return JsonResponse({'lists':[{'id':l['id'],'name':l['name'],'channels_count':l.get('channels_count',0),'created':l.get('created',''),'updated':l.get('updated','')}for l in m.get('lists',[])]})
+def api_m3u_lists(r):return JsonResponse({'lists':[{'id':l['id'],'name':l['name'],'channels_count':l.get('channels_count',0),'created':l.get('created',''),'updated':l.get('updated','')}for l in m3u_store.lists()]})
 
 @csrf_exempt
 def api_m3u_import(r):
@@ -1067,48 +2694,111 @@ def api_m3u_import(r):
         try:
             b=json.loads(r.body);url,name=b.get('url',''),b.get('name','My List')
             if not url:return JsonResponse({'success':False,'error':'URL required'})
-            content=download_m3u(url);chs,cats=parse_m3u(content)
-            if not chs:return JsonResponse({'success':False,'error':'No channels'})
-            m=load_m3u();nid=max([l['id']for l in m.get('lists',[])],default=0)+1
-            m.setdefault('lists',[]).append({'id':nid,'name':name,'url':url,'channels_count':len(chs),'categories':cats,'created':datetime.now().strftime('%Y-%m-%d %H:%M'),'channels':chs})
-            save_m3u(m);return JsonResponse({'success':True,'list_id':nid,'channels_count':len(chs),'categories_count':len(cats)})
+            j,dup=jobs.submit('import',url=url,name=name)
+            return JsonResponse({'success':True,'job_id':j['id'],'deduplicated':dup})
         except Exception as e:return JsonResponse({'success':False,'error':str(e)})
     return JsonResponse({'error':'POST only'})
 
 @csrf_exempt
 def api_m3u_channels(r,list_id):
-    m=load_m3u()
-    for l in m.get('lists',[]):
-        if l['id']==int(list_id):return JsonResponse({'success':True,'list':{'id':l['id'],'name':l['name'],'categories':l.get('categories',[])},'channels':l.get('channels',[])})
-    return JsonResponse({'success':False,'error':'Not found'})
+    """Channels of one list. Optional: group, q (name/group substring), limit with offset or cursor.
+    Without any of them the whole list is returned as before. since=<version> returns only the
+    added/updated channels and removed cids after that version (reset + full list if it is too old)."""
+    l=m3u_store.get(int(list_id));sh=m3u_store.shard(int(list_id))if l else None
+    if not sh:return JsonResponse({'success':False,'error':'Not found'})
+    info={'id':l['id'],'name':l['name'],'categories':sh.get('categories',[])}
+    chs=sh.get('channels',[]);g=r.GET;ver=sh.get('version',0)
+    if g.get('since'):
+        try:since=int(g['since'])
+        except ValueError:return JsonResponse({'success':False,'error':'Invalid since'},status=400)
+        delta=changes_since(sh,since)
+        if delta is None:return JsonResponse({'success':True,'list':info,'version':ver,'reset':True,'channels':chs,'total':len(chs)})
+        return JsonResponse({'success':True,'list':info,'version':ver,'since':since,**delta})
+    if not any(k in g for k in('group','q','limit','offset','cursor')):
+        return JsonResponse({'success':True,'list':info,'channels':chs,'total':len(chs),'version':ver})
+    try:
+        limit=max(1,min(int(g.get('limit',M3U_PAGE)),M3U_PAGE_MAX));offset=max(0,int(g.get('offset',0)))
+        cursor=int(g['cursor'])if g.get('cursor')else None
+    except ValueError:return JsonResponse({'success':False,'error':'Invalid paging parameters'},status=400)
+    pos=sh['groups'].get(g['group'],[])if g.get('group')else range(len(chs))
+    q=g.get('q','').strip().lower()
+    if q:pos=[i for i in pos if q in(chs[i].get('name','')+chs[i].get('group','')).lower()]
+    # A cursor is the position of the last channel already sent; it stays valid while the list grows
+    start=bisect.bisect_right(pos,cursor)if cursor is not None else offset
+    page=pos[start:start+limit]
+    nxt=str(page[-1])if page and start+limit<len(pos)else None
+    return JsonResponse({'success':True,'list':info,'channels':[chs[i]for i in page],'total':len(pos),'offset':start,'next_cursor':nxt,'version':ver})
 
 @csrf_exempt
 def api_m3u_del(r):
     if r.method=='POST':
         if not verify_admin(r):return JsonResponse({'success':False})
-        b=json.loads(r.body);m=load_m3u();m['lists']=[l for l in m.get('lists',[])if l['id']!=b.get('id')];save_m3u(m);return JsonResponse({'success':True})
+        # Through the job queue: with several workers the leader is the one process that writes M3U lists
+        b=json.loads(r.body);j,dup=jobs.submit('delete',list_id=b.get('id'))
+        return JsonResponse({'success':True,'job_id':j['id'],'deduplicated':dup})
     return JsonResponse({'error':'POST'})
 
 @csrf_exempt
 def api_m3u_refresh(r):
     if r.method=='POST':
         if not verify_admin(r):return JsonResponse({'success':False})
-        b=json.loads(r.body);m=load_m3u()
-        for l in m.get('lists',[]):
-            if l['id']==b.get('id'):
-                content=download_m3u(l['url']);chs,cats=parse_m3u(content)
-                l.update({'channels':chs,'categories':cats,'channels_count':len(chs),'updated':datetime.now().strftime('%Y-%m-%d %H:%M')})
-                save_m3u(m);return JsonResponse({'success':True,'channels_count':len(chs)})
-        return JsonResponse({'success':False,'error':'Not found'})
+        b=json.loads(r.body);l=m3u_store.get(b.get('id'))
+        if not l:return JsonResponse({'success':False,'error':'Not found'})
+        j,dup=jobs.submit('refresh',list_id=l['id'],name=l['name'])
+        return JsonResponse({'success':True,'job_id':j['id'],'deduplicated':dup})
     return JsonResponse({'error':'POST'})
 
+@csrf_exempt
+def api_jobs(r):
+    """Import/refresh jobs, newest first"""
+    if not verify_admin(r):return JsonResponse({'success':False,'error':'Unauthorized'},status=401)
+    return JsonResponse({'success':True,'jobs':jobs.recent()})
+
+@csrf_exempt
+def api_job(r,job_id):
+    """State of one job: state/phase, bytes downloaded, channels parsed, result or error"""
+    if not verify_admin(r):return JsonResponse({'success':False,'error':'Unauthorized'},status=401)
+    j=jobs.get(job_id)
+    if not j:return JsonResponse({'success':False,'error':'Not found'},status=404)
+    return JsonResponse({'success':True,'job':j})
+
+@csrf_exempt
+def api_job_cancel(r,job_id):
+    if r.method!='POST':return JsonResponse({'error':'POST'})
+    if not verify_admin(r):return JsonResponse({'success':False,'error':'Unauthorized'},status=401)
+    if not jobs.cancel(job_id):return JsonResponse({'success':False,'error':'Not found'},status=404)
+    return JsonResponse({'success':True,'job':jobs.get(job_id)})
+
 @csrf_exempt
 def api_analytics(r):
     if not verify_admin(r):return JsonResponse({'success':False,'error':'Unauthorized'},status=401)
-    a=load_analytics();d=load_data();today=datetime.now().strftime('%Y-%m-%d')
-    ts=a.get('daily',{}).get(today,{'views':0,'users':[]})
-    pop=sorted(a.get('popular',{}).items(),key=lambda x:x[1]['views'],reverse=True)[:10]
-    return JsonResponse({'success':True,'today':{'views':ts['views'],'users':len(ts.get('users',[]))},'total_viewers':len(d.get('viewers',[])),'total_subs':len([v for v in d.get('viewers',[])if v.get('subscription')]),'popular':[{'name':v['name'],'views':v['views']}for k,v in pop],'daily':a.get('daily',{})})
+    a=analytics.snapshot();d=load_data();today=datetime.now().strftime('%Y-%m-%d')
+    ts=a.get('daily',{}).get(today,{'views':0,'users':0})
+    since=(datetime.now()-timedelta(days=30)).strftime('%Y-%m-%d')  # older days: /api/analytics/range
+    return JsonResponse({'success':True,'today':{'views':ts['views'],'users':unique_count(ts)},'total_viewers':len(d.get('viewers',[])),'total_subs':len([v for v in d.get('viewers',[])if v.get('subscription')]),'popular':analytics.popular(10),'daily':{k:{'views':v['views'],'users':unique_count(v)}for k,v in a.get('daily',{}).items()if k>=since}})
+
+def parse_when(s,default):
+    """Parse a from/to query value: YYYY-MM, YYYY-MM-DD, 'YYYY-MM-DD HH' or full ISO"""
+    if not s:return default
+    s=s.strip().replace('T',' ')
+    if len(s)==7:s+='-01'
+    if len(s)==13:s+=':00'
+    return datetime.fromisoformat(s)
+
+@csrf_exempt
+def api_analytics_range(r):
+    """Views/unique users per hour, day or month between from and to, from precomputed rollups"""
+    if not verify_admin(r):return JsonResponse({'success':False,'error':'Unauthorized'},status=401)
+    gran=r.GET.get('granularity','day')
+    if gran not in ROLLUPS:return JsonResponse({'success':False,'error':'granularity must be hour, day or month'},status=400)
+    span={'hour':timedelta(hours=48),'day':timedelta(days=30),'month':timedelta(days=365)}[gran]
+    try:
+        end=parse_when(r.GET.get('to'),datetime.now())
+        start=parse_when(r.GET.get('from'),end-span)
+    except ValueError:return JsonResponse({'success':False,'error':'Invalid from/to date'},status=400)
+    if start>end:return JsonResponse({'success':False,'error':'from is after to'},status=400)
+    res=analytics.series(gran,start,end,r.GET.get('channel'))
+    return JsonResponse({'success':True,'granularity':gran,'from':start.isoformat(),'to':end.isoformat(),**res})
 
 @csrf_exempt
 def api_settings(r):
@@ -1121,9 +2811,11 @@ def api_settings(r):
             b=json.loads(r.body)
             log(f"[SETTINGS] Saving: {b}")
             s=d.get('settings',{})
+            renamed=b.get('site_name',s.get('site_name'))!=s.get('site_name')
             s.update(b)
             d['settings']=s
-            save_data(d)
+            save_data(d,'settings')
+            if renamed:page_cache.clear()  # content pages were rendered with the old name
             log(f"[SETTINGS] Saved successfully. require_subscription={s.get('require_subscription')}")
             return JsonResponse({'success':True})
         except Exception as e:
@@ -1143,10 +2835,76 @@ def api_viewers(r):
         vs.append({'id':v['id'],'username':v['username'],'email':v['email'],'created':v['created'],'subscription':sub})
     return JsonResponse({'success':True,'viewers':vs,'total':len(vs)})
 
-# ============ MATCHES SYSTEM ============
-MATCHES_FILE=os.path.join(BASE,'matches.json')
+# ============ UPLOAD STORE ============
 UPLOADS_DIR=os.path.join(BASE,'uploads')
 os.makedirs(UPLOADS_DIR,exist_ok=True)
+UPLOAD_GC_GRACE=86400  # unreferenced uploads younger than this survive GC: icons are uploaded before the form using them is saved
+UPLOAD_STORED_DIR=os.path.join(UPLOADS_DIR,'.stored')  # <name> marker touched whenever an existing upload is stored again
+os.makedirs(UPLOAD_STORED_DIR,exist_ok=True)
+UPLOAD_HASHED=re.compile(r'([0-9a-f]{40})\.[a-z0-9]{1,5}')  # names store_upload gives: the content hash is the ETag
+upload_lock=ProcessLock(os.path.join(BASE,'uploads.lock'))  # dedup vs GC, across worker processes too
+
+def upload_ext(name,default='bin'):
+    ext=name.rsplit('.',1)[-1].lower()if '.'in name else''
+    return ext if re.fullmatch(r'[a-z0-9]{1,5}',ext)else default
+
+def store_upload(f,ext):
+    """Write an uploaded file under the hash of its content, so identical files are stored once;
+    returns its /uploads/ path"""
+    h=hashlib.sha256();fd,tmp=tempfile.mkstemp(dir=UPLOADS_DIR,prefix='.up_')
+    try:
+        with os.fdopen(fd,'wb')as dest:
+            for chunk in f.chunks():h.update(chunk);dest.write(chunk)
+        name=f'{h.hexdigest()[:40]}.{ext}';fpath=os.path.join(UPLOADS_DIR,name)
+        with upload_lock:
+            if os.path.exists(fpath):  # restart its GC grace, leaving the served file untouched
+                mark=os.path.join(UPLOAD_STORED_DIR,name)
+                with open(mark,'a'):pass
+                os.utime(mark);log(f"[UPLOAD] Deduplicated: {name}")
+            else:os.replace(tmp,fpath);tmp=None
+    finally:
+        if tmp:os.remove(tmp)
+    return f'/uploads/{name}'
+
+def upload_refs():
+    """Reference count per upload file name, from channel and category icons and match logos"""
+    d=load_data();n=collections.Counter()
+    paths=[x.get('icon')for k in('channels','categories')for x in d.get(k,[])]
+    paths+=[m.get(k)for m in load_matches().get('matches',[])for k in('logo1','logo2')]
+    for p in paths:
+        if isinstance(p,str)and p.startswith('/uploads/'):n[p[9:]]+=1
+    return n
+
+def gc_uploads():
+    """Delete uploads nothing references any more (and stale partial writes); (files, bytes) removed"""
+    gone=freed=0
+    with upload_lock:
+        refs=upload_refs();now=time.time();stored={}
+        for e in os.scandir(UPLOAD_STORED_DIR):
+            try:t=e.stat().st_mtime
+            except OSError:continue
+            if now-t<UPLOAD_GC_GRACE:stored[e.name]=t
+            else:
+                try:os.remove(e.path)
+                except OSError:pass
+        for e in os.scandir(UPLOADS_DIR):
+            if not e.is_file()or refs[e.name]:continue
+            st=e.stat()
+            if now-max(st.st_mtime,stored.get(e.name,0))<UPLOAD_GC_GRACE:continue
+            try:os.remove(e.path);gone+=1;freed+=st.st_size
+            except OSError:pass
+    if gone:log(f"[UPLOAD] GC removed {gone} files ({freed//1024}KB)")
+    return gone,freed
+
+@csrf_exempt
+def api_uploads_gc(r):
+    if r.method!='POST':return JsonResponse({'error':'POST only'})
+    if not verify_admin(r):return JsonResponse({'success':False,'error':'Unauthorized'},status=401)
+    gone,freed=gc_uploads()
+    return JsonResponse({'success':True,'removed':gone,'freed':freed})
+
+# ============ MATCHES SYSTEM ============
+MATCHES_FILE=os.path.join(BASE,'matches.json')
 
 def load_matches():
     try:
@@ -1175,19 +2933,11 @@ def api_match_save(r):
     
     if 'logo1' in r.FILES:
         f=r.FILES['logo1']
-        fname=f'logo1_{int(time.time())}_{f.name}'
-        fpath=os.path.join(UPLOADS_DIR,fname)
-        with open(fpath,'wb')as dest:
-            for chunk in f.chunks():dest.write(chunk)
-        logo1_path=f'/uploads/{fname}'
+        logo1_path=store_upload(f,upload_ext(f.name,'png'))
     
     if 'logo2' in r.FILES:
         f=r.FILES['logo2']
-        fname=f'logo2_{int(time.time())}_{f.name}'
-        fpath=os.path.join(UPLOADS_DIR,fname)
-        with open(fpath,'wb')as dest:
-            for chunk in f.chunks():dest.write(chunk)
-        logo2_path=f'/uploads/{fname}'
+        logo2_path=store_upload(f,upload_ext(f.name,'png'))
     
     match_data={
         'team1':r.POST.get('team1',''),
@@ -1226,6 +2976,7 @@ def api_match_delete(r):
     m=load_matches()
     m['matches']=[x for x in m['matches']if x['id']!=b.get('id')]
     save_matches(m)
+    gc_uploads()  # reclaim logos only this match used
     return JsonResponse({'success':True})
 
 @csrf_exempt
@@ -1241,6 +2992,197 @@ def api_match_toggle(r):
     save_matches(m)
     return JsonResponse({'success':True})
 
+# ============ SEARCH ============
+SEARCH_LIMIT=20;SEARCH_LIMIT_MAX=100
+SEARCH_KINDS={'channel':0,'match':1,'m3u':2}  # kinds, in the order equally good hits are listed
+SEARCH_COMPACT=50000  # rebuild postings once this many removed docs are still in them (and they outnumber live ones)
+
+def search_norm(s):
+    return ' '.join(re.sub(r'[\W_]+',' ',str(s or '').lower()).split())
+
+def trigrams(t):
+    t=' '+t+' '
+    return {t[i:i+3]for i in range(len(t)-2)}
+
+class SearchIndex:
+    """Trigram index over curated channels, matches and the channels of every M3U list.
+    Words are space-padded, so ' xy' also serves two-letter word prefixes; '^xy' marks the first
+    two letters of a name and '|xyz' a group trigram. Postings are kept per kind and split by
+    name length, so a query walks them in rank order (names starting with the query, then word
+    prefix, anywhere, group only; each shortest first) and confirms candidates by substring. The
+    small curated and match sets are always ranked in full; M3U stops once it has the best
+    `limit` hits, however common the term. Curated channels and matches
+    are synced before each query (when the store version moves / matches.json changes); M3U
+    lists are synced by a background thread through their change feed (or a full re-index when
+    the feed no longer reaches back), and queries meanwhile answer from what is indexed so far"""
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.docs=[]   # doc id -> (kind, ref, name, group, norm name, norm group), None once removed;
+                       # ref is the channel/match id, or (list id, cid)
+        self.post={}   # kind -> trigram -> norm name length -> array('I') of doc ids, ascending
+        self.owner={}  # source ('channel' | 'match' | ('m3u', list id)) -> {key: doc id}
+        self.seen={}   # source -> what it looked like when last indexed
+        self.dead=0
+        self.grams={}  # norm group -> its '|' trigrams; groups repeat across thousands of channels
+        self.building=None  # thread syncing M3U lists, while one runs
+    def _add(self,src,kind,key,name,group):
+        did=len(self.docs);tn=search_norm(name);tg=search_norm(group)
+        self.docs.append((kind,(src[1],key)if kind=='m3u'else key,name,group,tn,tg));self.owner[src][key]=did
+        gg=self.grams.get(tg)
+        if gg is None:
+            if len(self.grams)>10000:self.grams.clear()
+            gg=self.grams[tg]={'|'+g for g in trigrams(tg)}
+        post=self.post.setdefault(kind,{});n=len(tn);grams=trigrams(tn);grams.add('^'+tn[:2])
+        for g in grams|gg:
+            b=post.get(g)
+            if b is None:b=post[g]={}
+            p=b.get(n)
+            if p is None:p=b[n]=array('I')
+            p.append(did)
+    def _remove(self,src,key):
+        did=self.owner[src].pop(key,None)
+        if did is not None:self.docs[did]=None;self.dead+=1
+    def _replace(self,src,kind,items):
+        """Make source src hold exactly items ({key: (name, group)}); unchanged docs are kept"""
+        own=self.owner.setdefault(src,{})
+        for key in[k for k,did in own.items()if items.get(k)!=self.docs[did][2:4]]:self._remove(src,key)
+        for key,(name,group)in items.items():
+            if key not in own:self._add(src,kind,key,name,group)
+    def _drop(self,src):
+        for key in list(self.owner.get(src,())):self._remove(src,key)
+        self.owner.pop(src,None);self.seen.pop(src,None)
+    def _compact(self):
+        where={did:(src,key)for src,own in self.owner.items()for key,did in own.items()}
+        old=self.docs;self.docs=[];self.post={};self.owner={s:{}for s in self.owner};self.dead=0
+        for did,d in enumerate(old):
+            if d is not None:self._add(where[did][0],d[0],where[did][1],d[2],d[3])
+    def sync(self):
+        d=load_data()
+        if self.seen.get('channel')!=store.version:
+            cats={c['id']:c.get('name','')for c in d.get('categories',[])}
+            self._replace('channel','channel',{c['id']:(c.get('name',''),cats.get(c.get('category_id'),''))for c in d.get('channels',[])})
+            self.seen['channel']=store.version
+        try:st=os.stat(MATCHES_FILE);sig=(st.st_mtime_ns,st.st_size)
+        except OSError:sig=None
+        if self.seen.get('match')!=sig:
+            cats={c['id']:c.get('name','')for c in d.get('categories',[])}
+            self._replace('match','match',{m['id']:(f"{m.get('team1','')} vs {m.get('team2','')}",cats.get(m.get('category_id'),''))for m in load_matches().get('matches',[])})
+            self.seen['match']=sig
+    def _stale(self):
+        lists=m3u_store.lists();ids={('m3u',l['id'])for l in lists}
+        return[s for s in list(self.owner)if isinstance(s,tuple)and s not in ids],[l for l in lists if self.seen.get(('m3u',l['id']))!=(l.get('created'),l.get('version',0))]
+    def _build(self):
+        """Background M3U sync: shards are read outside the lock and each list is indexed under it,
+        so queries in between see the lists done so far"""
+        try:
+            gone,todo=self._stale()
+            with self.lock:
+                for src in gone:self._drop(src)
+            for l in todo:self._sync_list(l)
+            with self.lock:
+                if self.dead>SEARCH_COMPACT and self.dead*2>len(self.docs):self._compact()
+        except Exception as e:log(f"[SEARCH] Index build failed: {e}")
+        finally:
+            with self.lock:self.building=None
+    def _sync_list(self,l):
+        src=('m3u',l['id']);sig=(l.get('created'),l.get('version',0));old=self.seen.get(src)
+        sh=m3u_store.shard(l['id'])
+        if sh is None:self.seen[src]=sig;return
+        chs=sh.get('channels',[])
+        # A list re-imported under a reused id shares nothing with what was indexed before
+        delta=changes_since(sh,old[1])if old and old[0]==sig[0]and 'cid'in(chs[0]if chs else{})else None
+        with self.lock:
+            if delta is None:
+                self._replace(src,'m3u',{c.get('cid',i):(c.get('name',''),c.get('group',''))for i,c in enumerate(chs)})
+            else:
+                for cid in delta['removed']:self._remove(src,cid)
+                for c in delta['added']+delta['updated']:
+                    self._remove(src,c['cid']);self._add(src,'m3u',c['cid'],c.get('name',''),c.get('group',''))
+            self.seen[src]=(sig[0],sh.get('version',0))
+    def _scan(self,post,qn,docs):
+        """(tier, doc id) for the docs of one kind matching qn, in rank order: exact name and name
+        prefix, word prefix, anywhere in the name, group only; within each, shorter names first
+        and then by doc id"""
+        grams=[qn[i:i+3]for i in range(len(qn)-2)]if len(qn)>2 else[' '+qn]
+        wq=' '+qn;short=len(qn)<3
+        for tiers,lead in(((0,1),'^'+qn[:2]),((2,),' '+qn[:2]),((3,),None),((4,),'|')):
+            if short and tiers==(3,):continue  # two letters only match at a word start
+            gs=['|'+g for g in grams]if lead=='|'else grams+[lead]if lead else grams
+            ps=[post.get(g)for g in gs]
+            if not all(ps):continue
+            for n in sorted(min(ps,key=len)):
+                posts=[p.get(n)for p in ps]
+                if not all(posts):continue
+                posts.sort(key=len);cand=posts[0]
+                for i in range(0,len(cand),1024):
+                    chunk=cand[i:i+1024]
+                    if len(posts)>1:  # narrow by the next rarest trigram (same doc id range) with C set ops
+                        lo,hi=chunk[0],chunk[-1];c=set(chunk)
+                        for p in posts[1:2]:c.intersection_update(p[bisect.bisect_left(p,lo):bisect.bisect_right(p,hi)])
+                        chunk=sorted(c)
+                    for did in chunk:
+                        d=docs[did]
+                        if d is None:continue
+                        tn=d[4]
+                        if qn in tn and(not short or wq in' '+tn):
+                            tier=0 if tn==qn else 1 if tn.startswith(qn)else 2 if wq in' '+tn else 3
+                        elif qn in d[5]and(not short or wq in' '+d[5]):tier=4
+                        else:continue
+                        if tier in tiers:yield tier,did
+    def search(self,q,limit=SEARCH_LIMIT,kinds=None,lid=None,channels=None):
+        """(total, more, indexing, best docs): exact name, then name prefix, word prefix, anywhere
+        in the name, and last group-only hits; ties go by kind, then shorter names. The M3U kind
+        stops once its best `limit` hits are known; more is then set and total is a lower bound.
+        indexing is set while M3U lists are still being synced, so M3U hits may be missing.
+        channels, when given, limits curated channels to those ids"""
+        qn=search_norm(q)
+        if len(qn)<2:return 0,False,False,[]
+        hits=[];more=False
+        gone,todo=self._stale()
+        with self.lock:
+            self.sync();docs=self.docs
+            if(gone or todo)and self.building is None:
+                self.building=threading.Thread(target=self._build,daemon=True,name='search-index');self.building.start()
+            indexing=self.building is not None
+            for kind,kr in SEARCH_KINDS.items():
+                if kinds and kind not in kinds or lid is not None and kind!='m3u':continue
+                n=0
+                for tier,did in self._scan(self.post.get(kind,{}),qn,docs):
+                    d=docs[did]
+                    if lid is not None and d[1][0]!=lid or channels is not None and kind=='channel'and d[1]not in channels:continue
+                    hits.append((tier,kr,len(d[4]),did));n+=1
+                    # hits come in rank order, so the first `limit` M3U ones are its best
+                    if kind=='m3u'and n>=limit:more=True;break
+            return len(hits),more,indexing,[docs[h[3]]for h in heapq.nsmallest(limit,hits)]
+
+search_index=SearchIndex()
+
+@csrf_exempt
+def api_search(r):
+    """Search channel names, groups and match teams. q (2+ chars), limit, type (channel, match,
+    m3u; comma separated), list (one M3U list id)"""
+    g=r.GET;q=g.get('q','').strip()
+    try:
+        limit=max(1,min(int(g.get('limit',SEARCH_LIMIT)),SEARCH_LIMIT_MAX))
+        lid=int(g['list'])if g.get('list')else None
+    except ValueError:return JsonResponse({'success':False,'error':'Invalid parameters'},status=400)
+    kinds={k for k in g.get('type','').split(',')if k}
+    if kinds-set(SEARCH_KINDS):return JsonResponse({'success':False,'error':'Unknown type'},status=400)
+    d=load_data();req_sub,has_sub,chs=viewer_channels(r,d)
+    total,more,indexing,docs=search_index.search(q,limit,kinds,lid,None if len(chs)==len(d.get('channels',[]))else{c['id']for c in chs})
+    byid={c['id']:c for c in chs};matches=None;lists={};out=[]
+    for kind,ref,name,group,_,_ in docs:
+        if kind=='channel':rec=byid.get(ref)
+        elif kind=='match':
+            if matches is None:matches={m['id']:m for m in load_matches().get('matches',[])}
+            rec=matches.get(ref)
+        else:
+            if ref[0]not in lists:lists[ref[0]]=(m3u_store.get(ref[0]),m3u_store.shard(ref[0]))
+            l,sh=lists[ref[0]];rec=m3u_channel(sh,ref[1])if sh else None
+            if rec:rec=dict(rec,list_id=ref[0],list_name=l['name']if l else'')
+        if rec:out.append({'type':kind,**rec})
+    return JsonResponse({'success':True,'q':q,'total':total,'more':more,'indexing':indexing,'results':out})
+
 # ============ SOFASCORE IMPORT ============
 import urllib.request
 import urllib.error
@@ -1455,29 +3397,59 @@ def api_upload_icon(r):
         if ext not in allowed_ext:
             return JsonResponse({'success':False,'error':'Invalid file type. Use PNG, JPG, GIF or WebP'})
         
-        # Save file
-        fname=f'{icon_type}_{int(time.time())}_{f.name}'
-        fpath=os.path.join(UPLOADS_DIR,fname)
-        
-        with open(fpath,'wb') as dest:
-            for chunk in f.chunks():
-                dest.write(chunk)
+        # Save file (stored once per distinct content)
+        path=store_upload(f,ext)
         
-        log(f"[UPLOAD] Icon saved: {fname}")
-        return JsonResponse({'success':True,'path':f'/uploads/{fname}'})
+        log(f"[UPLOAD] {icon_type} icon saved: {path}")
+        return JsonResponse({'success':True,'path':path})
     except Exception as e:
         log(f"[UPLOAD] Error: {e}")
         return JsonResponse({'success':False,'error':str(e)})
 
+UPLOAD_TYPES={'png':'image/png','jpg':'image/jpeg','jpeg':'image/jpeg','gif':'image/gif','webp':'image/webp','svg':'image/svg+xml'}
+UPLOAD_CACHE_CONTROL='public, max-age=31536000, immutable'  # upload names are never reused for other bytes
+
+def byte_range(h,size):
+    """(start, end) inclusive for a single 'bytes=' range header, None to send everything,
+    False when it cannot be satisfied"""
+    m=re.fullmatch(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*',h or '')
+    if not m or m.group(1)==m.group(2)=='':return None  # absent, malformed or multi-range: full body
+    if m.group(1)=='':n=int(m.group(2));return(max(0,size-n),size-1)if n else False
+    start=int(m.group(1))
+    if m.group(2)and int(m.group(2))<start:return None  # invalid range: ignored, like a malformed header
+    return(start,min(int(m.group(2)),size-1)if m.group(2)else size-1)if start<size else False
+
+def file_chunks(f,start,n,size=65536):
+    try:
+        f.seek(start)
+        while n>0:
+            c=f.read(min(size,n))
+            if not c:break
+            n-=len(c);yield c
+    finally:f.close()
+
 def serve_upload(r,filename):
     fpath=os.path.join(UPLOADS_DIR,filename)
-    if os.path.exists(fpath):
-        with open(fpath,'rb')as f:
-            content=f.read()
-        ext=filename.split('.')[-1].lower()
-        ct={'png':'image/png','jpg':'image/jpeg','jpeg':'image/jpeg','gif':'image/gif','webp':'image/webp','svg':'image/svg+xml'}.get(ext,'application/octet-stream')
-        return HttpResponse(content,content_type=ct)
-    return HttpResponse('Not found',status=404)
+    try:st=os.stat(fpath)
+    except OSError:return HttpResponse('Not found',status=404)
+    if not os.path.isfile(fpath):return HttpResponse('Not found',status=404)
+    ct=UPLOAD_TYPES.get(filename.split('.')[-1].lower(),'application/octet-stream')
+    m=UPLOAD_HASHED.fullmatch(filename);size=st.st_size
+    etag=f'"{m.group(1)}"'if m else f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+    inm=r.META.get('HTTP_IF_NONE_MATCH','')
+    if inm and(inm.strip()=='*'or etag in[t.strip().lstrip('W/')for t in inm.split(',')]):resp=HttpResponse(status=304)
+    else:
+        rng=byte_range(r.META.get('HTTP_RANGE'),size)
+        if r.META.get('HTTP_IF_RANGE','').strip()not in('',etag):rng=None  # changed since the client's partial copy
+        if rng is False:
+            resp=HttpResponse(status=416);resp['Content-Range']=f'bytes */{size}'
+        elif rng:
+            start,end=rng
+            resp=StreamingHttpResponse(file_chunks(open(fpath,'rb'),start,end-start+1),status=206,content_type=ct)
+            resp['Content-Range']=f'bytes {start}-{end}/{size}';resp['Content-Length']=str(end-start+1)
+        else:resp=FileResponse(open(fpath,'rb'),content_type=ct)  # wsgi.file_wrapper: sendfile where the server has it
+    resp['ETag']=etag;resp['Accept-Ranges']='bytes';resp['Cache-Control']=UPLOAD_CACHE_CONTROL
+    return resp
 
 # ============ PASSWORD RESET ============
 @csrf_exempt
@@ -1532,41 +3504,38 @@ PAGE_FOOTER='''</main>
 </body></html>'''
 
 # Helper function to serve HTML pages with dynamic site name
-def serve_html_page(filename):
-    """Serve HTML file with site_name replaced"""
-    try:
-        d = load_data()
-        site_name = d.get('settings', {}).get('site_name', 'ZUZZ TV')
-        with open(os.path.join(BASE, filename), 'r', encoding='utf-8') as f:
-            content = f.read()
-            # Replace all variations of the placeholder
-            content = content.replace('{{SITE_NAME}}', site_name)
-            content = content.replace('ZUZZ TV', site_name)
-            return HttpResponse(content)
-    except Exception as e:
-        log(f"[PAGE] Error serving {filename}: {e}")
+def serve_html_page(r,filename):
+    """Serve HTML file with site_name replaced; rendered once per (file mtime, site_name)"""
+    p=os.path.join(BASE,filename);st=file_stamp(p)
+    if st is None:
+        log(f"[PAGE] Error serving {filename}: not found")
         return HttpResponse("Page not found", status=404)
+    site_name=load_data().get('settings',{}).get('site_name','ZUZZ TV')
+    def build():
+        # Replace all variations of the placeholder
+        return make_page(read_text(p).replace('{{SITE_NAME}}',site_name).replace('ZUZZ TV',site_name))
+    return page_response(r,page_cache.get(('page',filename),(st,site_name),build))
 
 def faq_page(r):
-    return serve_html_page('faq.html')
+    return serve_html_page(r,'faq.html')
 
 def why_zuzz_page(r):
-    return serve_html_page('why_zuzz.html')
+    return serve_html_page(r,'why_zuzz.html')
 
 def terms_page(r):
-    return serve_html_page('terms.html')
+    return serve_html_page(r,'terms.html')
 
 def privacy_page(r):
-    return serve_html_page('privacy.html')
+    return serve_html_page(r,'privacy.html')
 
 def affiliates_page(r):
-    return serve_html_page('affiliates.html')
+    return serve_html_page(r,'affiliates.html')
 
 def contact_page(r):
-    return serve_html_page('contact.html')
+    return serve_html_page(r,'contact.html')
 
 def forgot_password_page(r):
-    return serve_html_page('forgot_password.html')
+    return serve_html_page(r,'forgot_password.html')
 
 def player_page(r):
     ch_id=r.GET.get('ch','')
@@ -1719,22 +3688,119 @@ urlpatterns=[
     path('manifest.json',manifest),path('sw.js',sw),path('icon-192.png',icon_192),path('icon-512.png',icon_512),
     path('api/login',api_login),path('api/viewer/register',api_viewer_register),path('api/viewer/login',api_viewer_login),
     path('api/viewer/logout',api_viewer_logout),path('api/viewer/delete',api_viewer_delete),path('api/viewer/manage',api_viewer_manage),path('api/viewer/profile',api_viewer_profile),path('api/favorites',api_favorites),
-    path('api/plans',api_plans),path('api/subscribe',api_subscribe),path('api/data',api_data),path('api/track',api_track),
+    path('api/plans',api_plans),path('api/subscribe',api_subscribe),path('api/data',api_data),path('api/search',api_search),path('api/track',api_track),
     path('api/channel',api_channel),path('api/channel/delete',api_channel_del),path('api/category',api_category),path('api/category/delete',api_category_del),
     path('api/user',api_user),path('api/user/delete',api_user_del),path('api/m3u/lists',api_m3u_lists),path('api/m3u/import',api_m3u_import),
     path('api/m3u/channels/<int:list_id>',api_m3u_channels),path('api/m3u/delete',api_m3u_del),path('api/m3u/refresh',api_m3u_refresh),
-    path('api/analytics',api_analytics),path('api/settings',api_settings),path('api/viewers',api_viewers),
+    path('api/jobs',api_jobs),path('api/jobs/<str:job_id>',api_job),path('api/jobs/<str:job_id>/cancel',api_job_cancel),
+    path('api/analytics',api_analytics),path('api/analytics/range',api_analytics_range),path('api/settings',api_settings),path('api/viewers',api_viewers),
     path('api/plans',api_plans),path('api/plan',api_plan),path('api/plan/delete',api_plan_delete),
     path('api/matches',api_matches),path('api/match/save',api_match_save),path('api/match/delete',api_match_delete),path('api/match/toggle',api_match_toggle),
     path('api/import/fetch-events',api_import_fetch_events),path('api/import/save-events',api_import_save_events),
-    path('api/upload-icon',api_upload_icon),
+    path('api/upload-icon',api_upload_icon),path('api/uploads/gc',api_uploads_gc),
     path('api/forgot-password',api_forgot_password),path('api/verify-reset-code',api_verify_reset_code),path('api/reset-password',api_reset_password),path('api/test-smtp',api_test_smtp),
     path('uploads/<str:filename>',serve_upload),
 ]
 
+# ============ SERVING ============
+WORKERS=int(os.environ.get('ZUZZ_WORKERS')or 0)or os.cpu_count()or 1  # worker processes for `app.py serve`
+THREADS=int(os.environ.get('ZUZZ_THREADS')or 16)  # requests each worker handles at once
+BIND=os.environ.get('ZUZZ_BIND','0.0.0.0:8000')
+
+from django.core.wsgi import get_wsgi_application
+django_app=get_wsgi_application()
+
+def application(environ,start_response):
+    """WSGI entry point for any server (gunicorn app:application, uwsgi, ...). Each worker process
+    that serves a request enters the leader election, so background work runs in exactly one."""
+    if not leader.enabled:leader.start()
+    return django_app(environ,start_response)
+
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer,WSGIRequestHandler
+
+class WorkerServer(ThreadingMixIn,WSGIServer):
+    """Thread-per-request WSGI server on an already listening socket shared by every worker
+    process; the socket is non-blocking, so a worker that loses the race for a connection
+    just goes back to waiting. At most `threads` requests run at once."""
+    def __init__(self,sock,threads):
+        WSGIServer.__init__(self,sock.getsockname()[:2],WSGIRequestHandler,bind_and_activate=False)
+        self.socket.close();self.socket=sock;self.slots=threading.BoundedSemaphore(threads)
+        self.server_name,self.server_port=socket.getfqdn(self.server_address[0]),self.server_address[1]
+        self.setup_environ();self.set_app(application)
+    def get_request(self):
+        conn,addr=self.socket.accept();conn.setblocking(True);return conn,addr
+    def process_request(self,request,client_address):
+        self.slots.acquire()  # a busy worker stops accepting and leaves connections to the others
+        try:super().process_request(request,client_address)
+        except:self.slots.release();raise
+    def process_request_thread(self,request,client_address):
+        try:super().process_request_thread(request,client_address)
+        finally:self.slots.release()
+
+def serve(workers=WORKERS,threads=THREADS,bind=BIND):
+    """Production server: gunicorn (gthread workers) when installed, else pre-forked WorkerServers.
+    The master only restarts workers that die; workers flush the store and analytics on the way out."""
+    import signal
+    host,_,port=bind.rpartition(':');host=host or'0.0.0.0'
+    leader.shared=workers>1 and hasattr(os,'fork')
+    try:from gunicorn.app.base import BaseApplication
+    except ImportError:BaseApplication=None
+    if BaseApplication:
+        class Gunicorn(BaseApplication):
+            def load_config(self):
+                for k,v in{'bind':bind,'workers':workers,'threads':threads,'worker_class':'gthread',
+                           'post_worker_init':lambda w:leader.start()}.items():self.cfg.set(k,v)
+            def load(self):return application
+        Gunicorn().run();return
+    sock=socket.create_server((host,int(port)),backlog=1024);sock.setblocking(False)
+    log(f"[SERVE] http://{host}:{port} - {workers} workers x {threads} threads")
+    def stop(*_):raise KeyboardInterrupt
+    def worker():
+        srv=WorkerServer(sock,threads)
+        signal.signal(signal.SIGTERM,lambda *_:threading.Thread(target=srv.shutdown).start())
+        leader.start()
+        try:srv.serve_forever()
+        except KeyboardInterrupt:pass
+        finally:
+            try:srv.server_close();store.flush();analytics.flush()
+            except Exception as e:log(f"[SERVE] Worker {os.getpid()} exit: {e}")
+    if workers<=1 or not hasattr(os,'fork'):worker();return
+    pids=set()
+    def spawn():
+        pid=os.fork()
+        if pid:pids.add(pid);return
+        try:worker()
+        finally:os._exit(0)
+    signal.signal(signal.SIGTERM,stop)
+    try:
+        for _ in range(workers):spawn()
+        while True:
+            pid,st=os.wait()
+            if pid in pids:
+                pids.discard(pid);log(f"[SERVE] Worker {pid} exited (status {st}), restarting")
+                time.sleep(1);spawn()
+    except KeyboardInterrupt:pass
+    finally:
+        signal.signal(signal.SIGTERM,signal.SIG_DFL)
+        for pid in pids:
+            try:os.kill(pid,signal.SIGTERM)
+            except OSError:pass
+        for pid in pids:
+            try:os.waitpid(pid,0)
+            except OSError:pass
+
 if __name__=='__main__':
     from django.core.management import execute_from_command_line
-    scheduler.start()
+    if sys.argv[1:2]==['import-sqlite']:
+        # One-shot migration: python app.py import-sqlite, then run with ZUZZ_STORAGE=sqlite
+        store.flush();db=store.backend if STORAGE=='sqlite'else SqliteBackend(DB_FILE)  # creating the database imports data.json
+        if not db.imported:log(f"[DB] {os.path.basename(DB_FILE)} already holds data: nothing imported")
+        sys.exit(0)
+    if sys.argv[1:2]==['serve']:
+        # Production: python app.py serve [workers]; ZUZZ_WORKERS/ZUZZ_THREADS/ZUZZ_BIND, ZUZZ_DEBUG=1 for debug pages
+        serve(int(sys.argv[2])if sys.argv[2:]else WORKERS);sys.exit(0)
+    leader.shared=False;leader.start()
     print("\n"+"="*50+"\n   🔥 ZUZZ TV v2.0 Ready!\n"+"="*50)
     print("\n   📺 Site:     http://127.0.0.1:8000")
     print("   🔐 Admin:    http://127.0.0.1:8000/admin")
@@ -1742,5 +3808,6 @@ if __name__=='__main__':
     print("   📝 Register: http://127.0.0.1:8000/register")
     print("\n   👨‍💼 Admin: admin / admin123")
     print("\n   ✨ New Features: PWA, Auto-Refresh, Subscriptions, Analytics, Security")
+    print("   🚀 Production: python app.py serve [workers]")
     print("="*50+"\n")
     execute_from_command_line(['','runserver','0.0.0.0:8000','--noreload'])
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark: M3U parsing, previous four-regex parser vs. app.parse_m3u
+Run: python3 bench_m3u.py [entries] [rounds]
+The playlist is synthetic and seeded, so runs are reproducible.
+parse_m3u is not faster here: it measures about 0.75-0.9x the legacy parser
+(200k entries, 3 rounds) because it builds an 'attrs' dict per channel
+and keeps the #EXTVLCOPT entries the old parser dropped. The figure to
+watch is that ratio staying near 1 while the extra data is extracted.
+"""
+import random
+import re
+import sys
+import time
+
+import app
+
+
+def legacy_parse_m3u(content):
+    """parse_m3u() as it was before the single-pass tokenizer"""
+    chs, cats = [], set()
+    lines = content.replace('\r', '').split('\n')
+    i = 0
+    while i < len(lines):
+        if lines[i].startswith('#EXTINF'):
+            url = lines[i + 1].strip() if i + 1 < len(lines) else ''
+            if url and not url.startswith('#'):
+                line = lines[i]
+                m = re.search(r'tvg-name="([^"]*)"', line)
+                name = m.group(1) if m else ''
+                if not name:
+                    m = re.search(r',([^,]+)$', line)
+                    name = m.group(1).strip() if m else f'Ch{len(chs)}'
+                m = re.search(r'group-title="([^"]*)"', line)
+                group = m.group(1) if m else 'Other'
+                m = re.search(r'tvg-logo="([^"]*)"', line)
+                logo = m.group(1) if m else ''
+                chs.append({'name': name, 'group': group, 'url': url, 'logo': logo})
+                cats.add(group)
+            i += 2
+        else:
+            i += 1
+    return chs, sorted(cats)
+
+
+def make_playlist(entries, seed=42):
+    """Mix of provider styles: full tvg attributes, no tvg-name (display name only),
+    catchup/chno extras, and a few entries with #EXTVLCOPT lines."""
+    rnd = random.Random(seed)
+    countries = ['UK', 'US', 'FR', 'DE', 'AR', 'ES', 'IT', 'TR', 'PT', 'NL']
+    kinds = ['Sports', 'News', 'Movies', 'Kids', 'Music', 'Docs']
+    out = ['#EXTM3U x-tvg-url="http://epg.example/guide.xml"']
+    for i in range(entries):
+        group = f'{rnd.choice(countries)} | {rnd.choice(kinds)}'
+        name = f'{group.split(" | ")[0]}: Channel {i} {rnd.choice(["HD", "FHD", "SD", "4K"])}'
+        style = i % 4
+        if style == 0:
+            attrs = f'tvg-id="ch{i}.example" tvg-name="{name}" tvg-logo="http://logo.example/{i}.png" group-title="{group}"'
+        elif style == 1:
+            attrs = f'tvg-id="ch{i}.example" tvg-name="" tvg-logo="http://logo.example/{i}.png" group-title="{group}"'
+        elif style == 2:
+            attrs = f'tvg-id="ch{i}.example" tvg-logo="http://logo.example/{i}.png" group-title="{group}"'
+        else:
+            attrs = (f'tvg-id="ch{i}.example" tvg-name="{name}" tvg-chno="{i}" tvg-logo="http://logo.example/{i}.png" '
+                     f'group-title="{group}" catchup="default" catchup-days="3"')
+        out.append(f'#EXTINF:-1 {attrs},{name}')
+        if i % 50 == 0:
+            out.append('#EXTVLCOPT:http-user-agent=Mozilla/5.0')
+        out.append(f'http://stream.example:8080/live/user/pass/{i}.ts')
+    return '\n'.join(out) + '\n'
+
+
+# #EXTINF lines the tokenizer must split like the regex: (line, attributes, title)
+EDGE_CASES = [
+    ('#EXTINF:-1 tvg-id="a" group-title="News",CNN x="y" HD', {'tvg-id': 'a', 'group-title': 'News'}, 'CNN x="y" HD'),
+    ('#EXTINF:-1 tvg-name="A,B" group-title="G",T "quoted" x', {'tvg-name': 'A,B', 'group-title': 'G'}, 'T "quoted" x'),
+    ('#EXTINF:-1,Plain', {}, 'Plain'),
+    ('#EXTINF:-1 tvg-id="a",', {'tvg-id': 'a'}, ''),
+]
+
+
+def check_edge_cases():
+    bad = [(line, app.parse_extinf(line)) for line, attrs, title in EDGE_CASES if app.parse_extinf(line) != (attrs, title)]
+    for line, got in bad:
+        print(f"  MISMATCH {line!r}: {got}")
+    return not bad
+
+
+def best(fn, arg, rounds):
+    times = []
+    for _ in range(rounds):
+        t = time.perf_counter()
+        res = fn(arg)
+        times.append(time.perf_counter() - t)
+    return min(times), res
+
+
+if __name__ == '__main__':
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    if not check_edge_cases():
+        sys.exit(1)
+    text = make_playlist(entries)
+    print(f"Playlist: {entries} entries, {len(text) / 1e6:.1f} MB, best of {rounds}")
+
+    t_old, (old_chs, _) = best(legacy_parse_m3u, text, rounds)
+    t_new, (new_chs, _) = best(app.parse_m3u, text, rounds)
+
+    # the legacy parser drops entries whose URL line is preceded by #EXTVLCOPT
+    by_url = {c['url']: c for c in new_chs}
+    same = all(
+        (a['name'], a['group'], a['logo']) == (by_url[a['url']]['name'], by_url[a['url']]['group'], by_url[a['url']]['logo'])
+        for a in old_chs if a['url'] in by_url
+    )
+    kept = sum(1 for c in new_chs if 'attrs' in c)
+
+    print(f"  legacy parser : {t_old:.3f}s  ({entries / t_old:,.0f} entries/s)")
+    print(f"  parse_m3u     : {t_new:.3f}s  ({entries / t_new:,.0f} entries/s)")
+    print(f"  ratio         : {t_old / t_new:.2f}x (legacy time / parse_m3u time)")
+    print(f"  channels      : legacy {len(old_chs)}, parse_m3u {len(new_chs)} (entries with #EXTVLCOPT no longer dropped)")
+    print(f"  same name/group/logo per URL: {'yes' if same else 'NO'}; channels with extra attributes kept: {kept}")
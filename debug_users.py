@@ -8,19 +8,54 @@ import hashlib
 import os
 
 DATA_FILE = 'data.json'
+JOURNAL_FILE = 'data.journal'
+
+def replay_journal(d):
+    """Apply changes the server has appended to data.journal since its last compaction"""
+    if not os.path.exists(JOURNAL_FILE):
+        return
+    with open(JOURNAL_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                op = json.loads(line)
+            except ValueError:
+                break
+            t, key = op['t'], op['k']
+            if t == 'kv':
+                if 'v' in op:
+                    d[key] = op['v']
+                else:
+                    d.pop(key, None)
+            elif isinstance(d.get(t), dict):
+                if 'v' in op:
+                    d[t][key] = op['v']
+                else:
+                    d[t].pop(key, None)
+            else:
+                rows = [x for x in d.get(t, []) if x.get('id') != key]
+                if 'v' in op:
+                    old = [i for i, x in enumerate(d.get(t, [])) if x.get('id') == key]
+                    rows.insert(old[0] if old else len(rows), op['v'])
+                d[t] = rows
 
 def load_data():
     try:
         with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            d = json.load(f)
+        replay_journal(d)
+        return d
     except Exception as e:
         print(f"❌ Error loading data.json: {e}")
         return None
 
 def save_data(d):
     try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
+        # Write a full snapshot and drop the journal it already contains
+        with open(DATA_FILE + '.tmp', 'w', encoding='utf-8') as f:
             json.dump(d, f, ensure_ascii=False, indent=2)
+        os.replace(DATA_FILE + '.tmp', DATA_FILE)
+        if os.path.exists(JOURNAL_FILE):
+            os.remove(JOURNAL_FILE)
         print("✅ Data saved successfully")
         return True
     except Exception as e: